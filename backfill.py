@@ -0,0 +1,72 @@
+"""One-off job: classify episodes stored before media types were tracked.
+
+    python backfill.py
+
+The type is read out of each file_id; ids that can't be decoded are checked
+with getFile, which sends nothing to users. Whatever is still unknown is
+learned by send_episode on first delivery.
+"""
+import asyncio
+import logging
+
+from aiogram import Bot
+
+import db
+from fileid import media_type_of
+
+log = logging.getLogger(__name__)
+
+
+async def _probe(bot: Bot, file_id: str) -> str:
+    try:
+        f = await bot.get_file(file_id)
+    except Exception:
+        return ""
+    # getFile paths start with the file's kind; video notes, audio etc. are
+    # left to send_episode, like file_ids that can't be decoded
+    path = f.file_path or ""
+    if path.startswith("videos/"):
+        return "video"
+    if path.startswith("documents/"):
+        return "document"
+    return ""
+
+
+async def backfill_media_types(bot: Bot | None = None, chunk: int = 500) -> tuple[int, int]:
+    """Returns (classified, still unknown)."""
+    after = (0, 0, 0)
+    classified = unknown = 0
+    while True:
+        rows = await db.episodes_without_media_type(after, chunk)
+        if not rows:
+            break
+        after = rows[-1][:3]
+        found = []
+        for anime_id, season_no, episode_no, file_id in rows:
+            media_type = media_type_of(file_id)
+            if not media_type and bot is not None:
+                media_type = await _probe(bot, file_id)
+            if media_type:
+                found.append((anime_id, season_no, episode_no, media_type))
+            else:
+                unknown += 1
+        await db.set_media_types(found)
+        classified += len(found)
+    return classified, unknown
+
+
+async def _run():
+    import main as app
+
+    logging.basicConfig(level=logging.INFO)
+    await db.init_db()
+    try:
+        classified, unknown = await backfill_media_types(app.bot)
+        log.info("media types: %s classified, %s unknown", classified, unknown)
+    finally:
+        await db.close_db()
+        await app.bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_run())
@@ -0,0 +1,170 @@
+"""Online database backups and a JSONL export of the catalogue.
+
+    python backup.py                  # backups/data-YYYYmmdd-HHMMSS.db.gz
+    python backup.py --export FILE    # manifest for importer.py (.gz = compressed)
+
+The copy uses SQLite's backup API from its own connection, PAGES pages per
+step with a short pause between steps, in a worker thread: the event loop
+and the writer connection keep running meanwhile. That connection holds one
+read transaction for the whole copy, so the backup is the snapshot taken
+when it started; without it every write made during the copy would restart
+the backup from page one.
+"""
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+import db
+
+log = logging.getLogger(__name__)
+
+PAGES = 1024  # 4 MB per step with the default 4 KB pages
+STEP_PAUSE = 0.002
+KEEP = 7
+DB_PREFIX = "data-"
+EXPORT_PREFIX = "catalogue-"
+EXPORT_CHUNK = 500  # anime per read
+
+_lock = asyncio.Lock()
+
+
+def _stamp() -> str:
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def rotate(directory: str, prefix: str, suffix: str, keep: int):
+    """Delete all but the newest `keep` (0 = keep all) files named prefix<stamp>suffix."""
+    names = sorted(n for n in os.listdir(directory) if n.startswith(prefix) and n.endswith(suffix))
+    for name in names[:-keep] if keep > 0 else []:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            log.warning("could not remove old backup %s", name, exc_info=True)
+
+
+def _remove(*paths: str):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ---------- DATABASE ----------
+def _copy(src_path: str, dest: str, pages: int, pause: float):
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True, isolation_level=None)
+    dst = sqlite3.connect(dest)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()  # opens the read snapshot
+        # `sleep=` only applies when a step hits BUSY/LOCKED; progress runs after every step
+        src.backup(dst, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+        src.execute("COMMIT")
+    finally:
+        dst.close()
+        src.close()
+
+
+def _compress(src: str, dest: str):
+    with open(src, "rb") as f, gzip.open(dest, "wb", compresslevel=6) as g:
+        shutil.copyfileobj(f, g, 1 << 20)
+
+
+async def make_backup(directory: str = "backups", keep: int = KEEP, pages: int = PAGES,
+                      pause: float = STEP_PAUSE) -> str:
+    """Copy the live database to `directory` as a gzipped file, keeping the
+    newest `keep` backups; returns the new file's path."""
+    async with _lock:
+        os.makedirs(directory, exist_ok=True)
+        final = os.path.join(directory, f"{DB_PREFIX}{_stamp()}.db.gz")
+        raw, part = final[:-3] + ".tmp", final + ".part"
+        try:
+            await asyncio.to_thread(_copy, db.DB_PATH, raw, pages, pause)
+            await asyncio.to_thread(_compress, raw, part)
+            os.replace(part, final)
+        finally:
+            _remove(raw, part)
+        rotate(directory, DB_PREFIX, ".db.gz", keep)
+        return final
+
+
+# ---------- CATALOGUE EXPORT ----------
+def _compact(d: dict) -> dict:
+    return {k: v for k, v in d.items() if v not in ("", None)}
+
+
+def manifest_lines(anime: list[dict], seasons: list[tuple], episodes: list[tuple]):
+    """importer.py manifest rows for one db.catalogue_page(): each title, then
+    its empty seasons and its episodes."""
+    seasons_of = {k: list(g) for k, g in itertools.groupby(seasons, key=lambda s: s[0])}
+    episodes_of = {k: list(g) for k, g in itertools.groupby(episodes, key=lambda e: e[0])}
+    for a in anime:
+        row = {"anime_id": a["id"],
+               **{f: a[f] for f in ("title", "year", "country", "language", "genres", "description")}}
+        if a["is_locked"]:
+            row["lock_code"] = a["lock_code"]
+        yield json.dumps(_compact(row), ensure_ascii=False) + "\n"
+        for _, season_no, count in seasons_of.get(a["id"], ()):
+            if not count:
+                yield json.dumps({"season_no": season_no}) + "\n"
+        for _, season_no, episode_no, file_id, media_type, caption in episodes_of.get(a["id"], ()):
+            row = {"season_no": season_no, "episode_no": episode_no, "file_id": file_id,
+                   "media_type": media_type, "caption": caption}
+            yield json.dumps(_compact(row), ensure_ascii=False) + "\n"
+
+
+async def export_catalogue(path: str, chunk: int = EXPORT_CHUNK) -> tuple[int, int]:
+    """Stream the catalogue to `path` as a JSONL manifest (gzipped if it ends
+    in .gz), a page of `chunk` titles at a time; returns (anime, episodes)."""
+    part = path + ".part"
+    opener = gzip.open if path.endswith(".gz") else open
+    n_anime = n_episodes = after = 0
+    try:
+        with opener(part, "wt", encoding="utf-8") as f:
+            while True:
+                anime, seasons, episodes = await db.catalogue_page(after, chunk)
+                if not anime:
+                    break
+                after = anime[-1]["id"]
+                n_anime += len(anime)
+                n_episodes += len(episodes)
+                await asyncio.to_thread(f.write, "".join(manifest_lines(anime, seasons, episodes)))
+        os.replace(part, path)
+    finally:
+        _remove(part)
+    return n_anime, n_episodes
+
+
+async def make_export(directory: str = "backups", keep: int = KEEP) -> tuple[str, int, int]:
+    """export_catalogue() into `directory` with rotation; (path, anime, episodes)."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{EXPORT_PREFIX}{_stamp()}.jsonl.gz")
+    n_anime, n_episodes = await export_catalogue(path)
+    rotate(directory, EXPORT_PREFIX, ".jsonl.gz", keep)
+    return path, n_anime, n_episodes
+
+
+async def _run(args):
+    logging.basicConfig(level=logging.INFO)
+    await db.init_db()
+    try:
+        if args.export:
+            n_anime, n_episodes = await export_catalogue(args.export)
+            log.info("exported %s anime, %s episodes to %s", n_anime, n_episodes, args.export)
+        else:
+            log.info("backup written to %s", await make_backup(args.dir, args.keep))
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--dir", default="backups")
+    p.add_argument("--keep", type=int, default=KEEP)
+    p.add_argument("--export", metavar="FILE", help="write the catalogue manifest instead")
+    asyncio.run(_run(p.parse_args()))
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+log = logging.getLogger(__name__)
+
+
+class WriteBehind:
+    """Collects keyed writes in memory and hands them to `flush` in batches.
+
+    Repeated keys are coalesced with `merge(old, new)` (default: keep the
+    newest value). A batch goes out every `interval` seconds, or sooner once
+    `max_rows` keys are pending. A failed batch is merged back and retried.
+    """
+
+    def __init__(self, flush: Callable[[list[tuple[Hashable, Any]]], Awaitable[Any]],
+                 interval: float = 0.5, max_rows: int = 1000,
+                 merge: Callable[[Any, Any], Any] | None = None, name: str = "write-behind"):
+        self._flush_fn = flush
+        self.interval = interval
+        self.max_rows = max_rows
+        self._merge = merge
+        self.name = name
+        self._pending: dict = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, key: Hashable, value: Any = None):
+        if self._merge is not None and key in self._pending:
+            value = self._merge(self._pending[key], value)
+        self._pending[key] = value
+        if len(self._pending) >= self.max_rows:
+            self._wake.set()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await self._flush_fn(list(batch.items()))
+            except asyncio.CancelledError:
+                self._restore(batch)
+                raise
+            except Exception:
+                log.exception("%s: flush of %s rows failed, will retry", self.name, len(batch))
+                self._restore(batch)
+
+    def _restore(self, batch: dict):
+        for key, value in batch.items():
+            if key in self._pending and self._merge is not None:
+                self._pending[key] = self._merge(value, self._pending[key])
+            else:
+                self._pending.setdefault(key, value)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=self.name)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class Debounce:
+    """Groups items per key and calls `handler(key, items)` once no new item
+    has arrived for that key within `delay` seconds, or as soon as
+    `max_items` are waiting."""
+
+    def __init__(self, handler: Callable[[Hashable, list], Awaitable[Any]],
+                 delay: float = 1.5, max_items: int = 200):
+        self._handler = handler
+        self.delay = delay
+        self.max_items = max_items
+        self._items: dict[Hashable, list] = {}
+        self._timers: dict[Hashable, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add(self, key: Hashable, item: Any):
+        items = self._items.setdefault(key, [])
+        items.append(item)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if len(items) >= self.max_items:
+            self._fire(key)
+        else:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.delay, self._fire, key)
+
+    def _fire(self, key: Hashable):
+        self._timers.pop(key, None)
+        items = self._items.pop(key, None)
+        if not items:
+            return
+        task = asyncio.create_task(self._call(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _call(self, key: Hashable, items: list):
+        try:
+            await self._handler(key, items)
+        except Exception:
+            log.exception("debounced handler failed for %r", key)
+
+    async def drain(self):
+        """Fire everything still waiting and wait for the handlers."""
+        for key in list(self._items):
+            self._fire(key)
+        if self._tasks:
+            await asyncio.wait(set(self._tasks))
@@ -0,0 +1,382 @@
+"""Load test: replay a synthetic update stream through main.dp.
+
+    python bench.py --anime 2000 --episodes 50 --updates 20000 --concurrency 32
+
+The bot talks to fakebot.FakeSession and a throwaway SQLite catalogue seeded
+with `--seed`, so nothing leaves the process and two runs with the same
+arguments send the same updates. Reports updates/sec, per-handler latency
+percentiles and SQLite statements per update.
+
+    python bench.py --import-rows 100000 --episodes 24
+
+times importer.ManifestImport instead, on a synthetic JSONL manifest of
+titles with `--episodes` episode rows each.
+
+    python bench.py --search-titles 100000
+
+times db.search_anime (caches bypassed) on a catalogue of that many titles.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+
+import callbacks
+
+WORDS = (
+    "Naruto", "One", "Piece", "Bleach", "Attack", "Titan", "Hunter", "Death", "Note", "Dragon",
+    "Ball", "Sword", "Online", "Demon", "Slayer", "Jujutsu", "Kaisen", "Tokyo", "Ghoul", "Qahramon",
+)
+GENRES = ("action", "comedy", "drama", "fantasy", "romance", "sci-fi")
+
+# share of each update kind in the stream
+MIX = (
+    ("start", 0.15),
+    ("season", 0.15),
+    ("page", 0.15),
+    ("episode", 0.35),
+    ("search", 0.10),
+    ("code", 0.10),
+)
+
+FIRST_USER = 10_000
+
+
+# ---------- CATALOGUE ----------
+async def seed(db, rng: random.Random, anime: int, seasons: int, episodes: int, users: int,
+               locked: float) -> dict:
+    """Fill a fresh database; returns what the update generator needs to know."""
+    titles, codes = [], {}
+    free_codes = [f"{n:03d}" for n in range(1000)]
+    rng.shuffle(free_codes)
+    for i in range(anime):
+        title = " ".join(rng.sample(WORDS, rng.randint(2, 3))) + f" {i}"
+        anime_id = await db.add_anime(title, str(rng.randint(1990, 2025)), "Yaponiya", "O‘zbek",
+                                      ", ".join(rng.sample(GENRES, 2)), "Sintetik tavsif")
+        titles.append(title)
+        for s in range(1, seasons + 1):
+            await db.ensure_season(anime_id, s)
+            await db.add_episodes(anime_id, s, [
+                db.Media(f"bench-{anime_id}-{s}-{e}", "video") for e in range(1, episodes + 1)
+            ])
+        if free_codes and rng.random() < locked:
+            code = free_codes.pop()
+            await db.set_anime_lock(anime_id, 1, code)
+            codes[code] = anime_id
+
+    now = int(time.time())
+    batch = [(FIRST_USER + u, now - rng.randint(0, 30 * 86400)) for u in range(users)]
+    for i in range(0, len(batch), 5000):
+        await db.upsert_users(batch[i:i + 5000])
+    return {"anime": anime, "seasons": seasons, "episodes": episodes, "users": users,
+            "titles": titles, "codes": list(codes)}
+
+
+# ---------- UPDATES ----------
+class UpdateFactory:
+    def __init__(self, rng: random.Random, catalogue: dict, page_size: int):
+        self.rng = rng
+        self.cat = catalogue
+        self.page_size = page_size
+        self.update_id = 0
+        self.kinds = [k for k, _ in MIX]
+        self.weights = [w for _, w in MIX]
+
+    def _user(self) -> dict:
+        uid = FIRST_USER + self.rng.randrange(self.cat["users"])
+        return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+    def _message(self, text: str) -> dict:
+        user = self._user()
+        return {"message": {
+            "message_id": self.rng.randint(1, 10 ** 6), "date": int(time.time()),
+            "chat": {"id": user["id"], "type": "private"}, "from": user, "text": text,
+        }}
+
+    def _callback(self, data: str) -> dict:
+        user = self._user()
+        return {"callback_query": {
+            "id": str(self.update_id), "from": user, "chat_instance": "bench", "data": data,
+            "message": {
+                "message_id": self.rng.randint(1, 10 ** 6), "date": int(time.time()),
+                "chat": {"id": user["id"], "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "bot"}, "text": "…",
+            },
+        }}
+
+    def _target(self) -> tuple[int, int, int]:
+        c = self.cat
+        return (self.rng.randint(1, c["anime"]), self.rng.randint(1, c["seasons"]),
+                self.rng.randint(1, c["episodes"]))
+
+    def next(self) -> tuple[str, dict]:
+        self.update_id += 1
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        a, s, e = self._target()
+        if kind == "start":
+            body = self._message(f"/start {a}")
+        elif kind == "season":
+            body = self._callback(f"s:{a}:{s}")
+        elif kind == "page":
+            start = (self.rng.randrange(max(1, self.cat["episodes"] // self.page_size)) * self.page_size) + 1
+            body = self._callback(f"p:{a}:{s}:{start}")
+        elif kind == "episode":
+            body = self._callback(f"e:{a}:{s}:{e}")
+        elif kind == "search":
+            words = self.rng.choice(self.cat["titles"]).split()[:-1]
+            body = self._message(f"/search {self.rng.choice(words)[:self.rng.randint(3, 6)]}")
+        else:
+            codes = self.cat["codes"]
+            right = codes and self.rng.random() < 0.5
+            body = self._message(self.rng.choice(codes) if right else f"{self.rng.randrange(1000):03d}")
+        return kind, {"update_id": self.update_id, **body}
+
+
+# ---------- MEASURING ----------
+class Recorder:
+    """Names the handler that took each update and counts SQLite statements."""
+
+    def __init__(self):
+        self.latency: dict[str, list[float]] = defaultdict(list)
+        self.queries: dict[str, int] = defaultdict(int)
+        self.statements = 0
+
+    def trace(self, sql: str):
+        # trigger bodies are reported as "-- TRIGGER ..."; count what we issued
+        if not sql.startswith("--"):
+            self.statements += 1
+
+    async def attach(self, db):
+        for conn in (db._writer, *db._reader_conns):
+            await conn.set_trace_callback(self.trace)
+
+    async def handler_middleware(self, handler, event, data):
+        slot = data.get("bench_slot")
+        if slot is not None:
+            fn = data["handler"].callback
+            if fn == callbacks.router.dispatch:
+                found = callbacks.router.route(event.data or "")
+                fn = found[1] if found else fn
+            slot[0] = fn.__name__
+        return await handler(event, data)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[i]
+
+
+# ---------- RUN ----------
+def _env():
+    # main.py reads these at import; the token is never sent anywhere
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH-fake-token")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ.setdefault("PRERENDER_ON_ADD", "0")
+    os.environ["BOT_API_URL"] = ""
+    os.environ["BOT_MODE"] = "polling"
+    os.environ["WORKERS"] = "1"
+
+
+async def run(args) -> dict:
+    db_dir = tempfile.mkdtemp(prefix="bench-")
+    _env()
+    try:
+        import db
+        import main
+        import render
+        from aiogram.methods import TelegramMethod
+        from aiogram.types import Update
+        from fakebot import FakeSession
+
+        session = FakeSession(latency=args.api_latency)
+        if args.limiter:
+            session.middleware(main.limiter)
+        main.bot.session = session
+        bot, dp = main.bot, main.dp
+
+        rng = random.Random(args.seed)
+        await db.init_db(os.path.join(db_dir, "bench.db"))
+        t = time.perf_counter()
+        catalogue = await seed(db, rng, args.anime, args.seasons, args.episodes, args.users, args.locked)
+        seeded_in = time.perf_counter() - t
+        await main.startup()
+
+        rec = Recorder()
+        await rec.attach(db)
+        dp.message.middleware(rec.handler_middleware)
+        dp.callback_query.middleware(rec.handler_middleware)
+
+        factory = UpdateFactory(rng, catalogue, render.PAGE_SIZE)
+        stream = [factory.next() for _ in range(args.updates)]
+        sem = asyncio.Semaphore(args.concurrency)
+        errors = 0
+
+        async def one(kind: str, raw: dict):
+            nonlocal errors
+            async with sem:
+                slot = ["unhandled"]
+                before = rec.statements
+                start = time.perf_counter()
+                try:
+                    update = Update.model_validate(raw, context={"bot": bot})
+                    result = await dp.feed_update(bot, update, bench_slot=slot)
+                    if isinstance(result, TelegramMethod):
+                        await bot(result)  # what polling does with a returned answer
+                except Exception:
+                    errors += 1
+                rec.latency[slot[0]].append(time.perf_counter() - start)
+                rec.queries[slot[0]] += rec.statements - before
+
+        calls_before = sum(session.calls.values())
+        statements_before = rec.statements
+        t = time.perf_counter()
+        await asyncio.gather(*(one(kind, raw) for kind, raw in stream))
+        elapsed = time.perf_counter() - t
+        api_calls = sum(session.calls.values()) - calls_before
+        statements = rec.statements - statements_before
+        await main.shutdown()
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+    return {
+        "seeded_in": seeded_in, "elapsed": elapsed, "updates": args.updates, "errors": errors,
+        "statements": statements, "api_calls": api_calls, "latency": rec.latency,
+        "queries": rec.queries, "concurrency": args.concurrency,
+    }
+
+
+# ---------- IMPORT ----------
+def write_manifest(path: str, rng: random.Random, rows: int, episodes: int, locked: float):
+    """A title row followed by its episode rows, until `rows` rows are written."""
+    free_codes = [f"{n:03d}" for n in range(1000)]
+    rng.shuffle(free_codes)
+    with open(path, "w", encoding="utf-8") as f:
+        i = written = 0
+        while written < rows:
+            i += 1
+            title = {"anime_id": i, "title": " ".join(rng.sample(WORDS, rng.randint(2, 3))) + f" {i}",
+                     "year": str(rng.randint(1990, 2025)), "country": "Yaponiya", "language": "O‘zbek",
+                     "genres": ", ".join(rng.sample(GENRES, 2)), "description": "Sintetik tavsif"}
+            if free_codes and rng.random() < locked:
+                title["lock_code"] = free_codes.pop()
+            f.write(json.dumps(title, ensure_ascii=False) + "\n")
+            written += 1
+            for e in range(1, min(episodes, rows - written) + 1):
+                f.write(json.dumps({"season_no": 1, "episode_no": e, "file_id": f"bench-{i}-1-{e}"}) + "\n")
+                written += 1
+
+
+async def run_import(args) -> str:
+    db_dir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        import db
+        import importer
+
+        path = os.path.join(db_dir, "manifest.jsonl")
+        write_manifest(path, random.Random(args.seed), args.import_rows, args.episodes, args.locked)
+        await db.init_db(os.path.join(db_dir, "bench.db"))
+        try:
+            imp = await importer.ManifestImport(path).run()
+        finally:
+            await db.close_db()
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+    return (f"{imp.rows} rows ({imp.anime} anime, {imp.episodes} episodes, {imp.error_count} errors) "
+            f"in {imp.elapsed:.2f}s = {imp.rows / imp.elapsed * 60:,.0f} rows/min"
+            + (f"\n{imp.failed}" if imp.failed else ""))
+
+
+# ---------- SEARCH ----------
+SEARCH_QUERIES = ("drama", "naruto", "naruto one", "na", "sintetik", "titan 4", "zzz")
+SEARCH_REPEAT = 20
+
+
+async def run_search(args) -> str:
+    db_dir = tempfile.mkdtemp(prefix="bench-")
+    try:
+        import db
+
+        rng = random.Random(args.seed)
+        await db.init_db(os.path.join(db_dir, "bench.db"))
+        try:
+            for start in range(0, args.search_titles, 2000):
+                await db.import_chunk([
+                    {"id": -i - 1, "title": " ".join(rng.sample(WORDS, rng.randint(2, 3))) + f" {i}",
+                     "year": str(rng.randint(1990, 2025)), "country": "Yaponiya", "language": "O‘zbek",
+                     "genres": ", ".join(rng.sample(GENRES, 2)), "description": "Sintetik tavsif",
+                     "lock_code": None}
+                    for i in range(start, min(start + 2000, args.search_titles))
+                ], [], [])
+            lines = [f"{args.search_titles} titles", "",
+                     f"{'query':<14}{'results':>8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+            for q in SEARCH_QUERIES:
+                times = []
+                for _ in range(SEARCH_REPEAT):
+                    db.search_cache.clear()
+                    t = time.perf_counter()
+                    found = await db.search_anime(q, limit=20)
+                    times.append(time.perf_counter() - t)
+                times.sort()
+                lines.append(f"{q:<14}{len(found):>8}"
+                             + "".join(f"{v * 1000:>10.2f}" for v in (percentile(times, 50), percentile(times, 95), times[-1])))
+            return "\n".join(lines)
+        finally:
+            await db.close_db()
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+
+def report(r: dict) -> str:
+    n = r["updates"]
+    lines = [
+        f"seeded in {r['seeded_in']:.1f}s",
+        f"{n} updates in {r['elapsed']:.2f}s = {n / r['elapsed']:.0f} updates/s "
+        f"(concurrency {r['concurrency']}, {r['errors']} errors)",
+        f"{r['statements'] / n:.2f} SQL statements/update, {r['api_calls'] / n:.2f} Bot API calls/update",
+        "",
+        f"{'handler':<22}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'sql/upd':>10}",
+    ]
+    for name, values in sorted(r["latency"].items(), key=lambda kv: -len(kv[1])):
+        values.sort()
+        # with concurrency > 1 statements of overlapping updates are mixed together
+        per = f"{r['queries'][name] / len(values):.2f}" if r["concurrency"] == 1 else "-"
+        lines.append(
+            f"{name:<22}{len(values):>8}"
+            + "".join(f"{percentile(values, p) * 1000:>10.2f}" for p in (50, 95, 99))
+            + f"{per:>10}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--anime", type=int, default=1000)
+    p.add_argument("--seasons", type=int, default=2)
+    p.add_argument("--episodes", type=int, default=24, help="per season")
+    p.add_argument("--users", type=int, default=10000)
+    p.add_argument("--locked", type=float, default=0.1, help="share of titles behind a code")
+    p.add_argument("--updates", type=int, default=10000)
+    p.add_argument("--concurrency", type=int, default=32, help="1 = exact SQL counts per handler")
+    p.add_argument("--api-latency", type=float, default=0.0, help="seconds per fake Bot API call")
+    p.add_argument("--limiter", action="store_true", help="send through main.limiter (Telegram rate limits)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--import-rows", type=int, default=0, help="time a manifest import of this many rows instead")
+    p.add_argument("--search-titles", type=int, default=0, help="time searches over this many titles instead")
+    args = p.parse_args()
+    if args.import_rows:
+        print(asyncio.run(run_import(args)))
+    elif args.search_titles:
+        print(asyncio.run(run_search(args)))
+    else:
+        print(report(asyncio.run(run(args))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+
+from aiogram import Bot
+from aiogram.types import User
+
+log = logging.getLogger(__name__)
+
+
+class BotIdentity:
+    """The bot's own getMe result, fetched once at startup and refreshed in
+    the background, so building deep links costs no API call."""
+
+    def __init__(self, refresh_interval: float = 3600):
+        self.refresh_interval = refresh_interval
+        self.me: User | None = None
+
+    async def load(self, bot: Bot) -> User:
+        self.me = await bot.get_me()
+        return self.me
+
+    async def refresh_loop(self, bot: Bot):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load(bot)
+            except Exception:
+                log.warning("getMe refresh failed, keeping @%s", self.username, exc_info=True)
+
+    @property
+    def username(self) -> str:
+        if self.me is None:
+            raise RuntimeError("BotIdentity.load() has not run yet")
+        return self.me.username
+
+    def deep_link(self, payload: int | str) -> str:
+        return f"https://t.me/{self.username}?start={payload}"
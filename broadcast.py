@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+import db
+import ratelimit
+from callbacks import BroadcastAction
+
+log = logging.getLogger(__name__)
+
+CHUNK = 500
+CONCURRENCY = 25
+PROGRESS_EVERY = 3.0
+PRUNE_BATCH = 200
+HEARTBEAT_EVERY = 10.0
+# a broadcast whose owner has been silent this long may be taken over
+CLAIM_TIMEOUT = 60
+
+# who runs a broadcast: several webhook instances or workers share the table
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# errors after which a user will never receive anything again
+_GONE = ("chat not found", "user is deactivated", "bot was blocked", "user not found", "peer_id_invalid")
+
+_running: dict[int, "Broadcast"] = {}
+
+
+def episode_payload(anime_id: int, season_no: int, episode_no: int) -> dict:
+    return {"kind": "episode", "anime_id": anime_id, "season_no": season_no, "episode_no": episode_no}
+
+
+def copy_payload(from_chat_id: int, message_id: int) -> dict:
+    return {"kind": "copy", "from_chat_id": from_chat_id, "message_id": message_id}
+
+
+class Broadcast:
+    """One broadcast run, checkpointed in the `broadcasts` table.
+
+    User ids are read in keyset chunks of CHUNK and fanned out to CONCURRENCY
+    send workers; after each chunk the last user id and counters are saved,
+    so a restarted process resumes from there (a crash may re-send at most
+    one chunk). Only the process holding the row's claim (owner + heartbeat)
+    sends; run() returns at once if another live process holds it.
+    """
+
+    def __init__(self, bot: Bot, row: dict):
+        self.bot = bot
+        self.id = row["id"]
+        self.payload = json.loads(row["payload"])
+        self.active_since = row["active_since"]
+        self.admin_chat = row["admin_chat"]
+        self.total = row["total"]
+        self._load(row)
+        self.cancelled = False
+        self.lost = False  # the claim was taken over by another process
+        self._gone: list[int] = []
+        self._episode: db.EpisodeRow | None = None
+        self._as_document = False
+
+    def _load(self, row: dict):
+        self.progress_msg = row["progress_msg"]
+        self.last_user_id = row["last_user_id"]
+        self.ok = row["ok"]
+        self.blocked = row["blocked"]
+        self.failed = row["failed"]
+        # counters as of the last checkpoint; an interrupted chunk is re-sent
+        # on resume, so its deliveries must not be counted twice
+        self._committed = (self.ok, self.failed)
+
+    @property
+    def done(self) -> int:
+        return self.ok + self.blocked + self.failed
+
+    # ---------- sending ----------
+    async def _deliver(self, user_id: int):
+        p = self.payload
+        if p["kind"] == "copy":
+            await self.bot.copy_message(user_id, p["from_chat_id"], p["message_id"])
+            return
+        file_id, caption, media_type, _ = self._episode
+        if media_type == "document":
+            self._as_document = True
+        if not self._as_document:
+            try:
+                await self.bot.send_video(user_id, file_id, caption=caption)
+                return
+            except TelegramBadRequest as e:
+                if "document" not in str(e).lower():
+                    raise
+                self._as_document = True
+        await self.bot.send_document(user_id, file_id, caption=caption)
+
+    async def _send(self, user_id: int):
+        try:
+            await self._deliver(user_id)
+            self.ok += 1
+        except TelegramForbiddenError:
+            self.blocked += 1
+            self._gone.append(user_id)
+        except TelegramBadRequest as e:
+            if any(s in str(e).lower() for s in _GONE):
+                self.blocked += 1
+                self._gone.append(user_id)
+            else:
+                self.failed += 1
+        except Exception:
+            log.exception("broadcast %s: send to %s failed", self.id, user_id)
+            self.failed += 1
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                await self._send(user_id)
+            finally:
+                queue.task_done()
+
+    # ---------- bookkeeping ----------
+    async def _prune(self, force: bool = False):
+        if self._gone and (force or len(self._gone) >= PRUNE_BATCH):
+            gone, self._gone = self._gone, []
+            await db.delete_users(gone)
+
+    async def _checkpoint(self, status: str | None = None):
+        # status is only written at the end, so a stop recorded by another
+        # process is not overwritten mid-run
+        await self._prune(force=True)
+        fields = dict(last_user_id=self.last_user_id, ok=self.ok, blocked=self.blocked, failed=self.failed)
+        if status:
+            fields["status"] = status
+        await db.update_broadcast(self.id, **fields)
+
+    def _progress_text(self, status: str = "running") -> str:
+        head = {"running": "⏳ Yuborilmoqda", "done": "✅ Tugadi", "cancelled": "⛔ To‘xtatildi"}.get(status, status)
+        return (
+            f"📣 Tarqatish #{self.id}: {head}\n"
+            f"📨 {self.done}/{self.total}\n"
+            f"✅ Yetkazildi: {self.ok}\n"
+            f"🚫 Bloklagan: {self.blocked}\n"
+            f"⚠️ Xato: {self.failed}"
+        )
+
+    def _stop_kb(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="⛔ To‘xtatish", callback_data=BroadcastAction(action="stop", broadcast_id=self.id).pack())]
+        ])
+
+    async def _report(self, status: str = "running"):
+        kb = self._stop_kb() if status == "running" else None
+        try:
+            if self.progress_msg is None:
+                m = await self.bot.send_message(self.admin_chat, self._progress_text(status), reply_markup=kb)
+                self.progress_msg = m.message_id
+                await db.update_broadcast(self.id, progress_msg=self.progress_msg)
+            else:
+                await self.bot.edit_message_text(
+                    self._progress_text(status), chat_id=self.admin_chat,
+                    message_id=self.progress_msg, reply_markup=kb,
+                )
+        except TelegramBadRequest:
+            pass  # "message is not modified"
+        except Exception:
+            log.warning("broadcast %s: progress update failed", self.id, exc_info=True)
+
+    async def _progress_loop(self):
+        shown = -1
+        while True:
+            await asyncio.sleep(PROGRESS_EVERY)
+            if self.done != shown:
+                shown = self.done
+                await self._report()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_EVERY)
+            try:
+                alive = await db.touch_broadcast(self.id, OWNER)
+            except Exception:
+                log.warning("broadcast %s: heartbeat failed", self.id, exc_info=True)
+                continue
+            if not alive:
+                log.warning("broadcast %s: taken over by another process, stopping", self.id)
+                self.lost = self.cancelled = True
+                return
+
+    # ---------- run ----------
+    async def run(self):
+        if self.id in _running:
+            return
+        _running[self.id] = self  # before any await: one run per broadcast per process
+        try:
+            if await db.claim_broadcast(self.id, OWNER, CLAIM_TIMEOUT):
+                await self._run()
+        finally:
+            _running.pop(self.id, None)
+
+    async def _run(self):
+        # the previous owner may have checkpointed since this row was read
+        row = await db.get_broadcast(self.id)
+        self._load(row)
+        if self.payload["kind"] == "episode":
+            p = self.payload
+            self._episode = await db.get_episode(p["anime_id"], p["season_no"], p["episode_no"])
+            if not self._episode:
+                await db.update_broadcast(self.id, status="failed")
+                return
+
+        await self._report()
+        progress = asyncio.create_task(self._progress_loop())
+        heartbeat = asyncio.create_task(self._heartbeat_loop())
+        queue: asyncio.Queue = asyncio.Queue(maxsize=CONCURRENCY * 4)
+        with ratelimit.bulk():
+            workers = [asyncio.create_task(self._worker(queue)) for _ in range(CONCURRENCY)]
+        status = "running"
+        try:
+            while not self.cancelled:
+                ids = await db.user_ids_after(self.last_user_id, CHUNK, self.active_since)
+                if not ids:
+                    status = "done"
+                    break
+                for user_id in ids:
+                    await queue.put(user_id)
+                    await self._prune()
+                await queue.join()
+                self.last_user_id = ids[-1]
+                self._committed = (self.ok, self.failed)
+                await self._checkpoint()
+                # a stop pressed in another worker process lands in the table
+                row = await db.get_broadcast(self.id)
+                if row and row["status"] == "cancelled":
+                    self.cancelled = True
+            if self.cancelled and not self.lost:
+                status = "cancelled"
+        finally:
+            for task in (*workers, progress, heartbeat):
+                task.cancel()
+            if not self.lost:  # otherwise the new owner's checkpoints are the truth
+                if status == "running":
+                    self.ok, self.failed = self._committed
+                # on shutdown status stays "running" and resume_running() picks it up
+                await self._checkpoint(status)
+                await db.release_broadcast(self.id, OWNER)
+                await self._report(status)
+
+
+async def start(bot: Bot, payload: dict, admin_chat: int, active_since: int | None = None) -> Broadcast:
+    total = await db.count_users(active_since)
+    broadcast_id = await db.create_broadcast(json.dumps(payload), admin_chat, active_since, total)
+    return Broadcast(bot, await db.get_broadcast(broadcast_id))
+
+
+async def stop(broadcast_id: int) -> bool:
+    b = _running.get(broadcast_id)
+    if b is not None:
+        b.cancelled = True
+    row = await db.get_broadcast(broadcast_id)
+    if not row or row["status"] != "running":
+        return False
+    await db.update_broadcast(broadcast_id, status="cancelled")
+    return True
+
+
+async def resume_running(bot: Bot) -> list[Broadcast]:
+    """Running broadcasts not handled here; run() skips those another process owns."""
+    return [Broadcast(bot, row) for row in await db.running_broadcasts() if row["id"] not in _running]
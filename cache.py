@@ -0,0 +1,114 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share one run of the loader.
+
+    The load runs in its own task, so a waiter that gets cancelled (a user
+    closing the chat, a timeout) does not cancel it for everyone else.
+    """
+
+    def __init__(self):
+        self._flights: dict[Any, asyncio.Task] = {}
+        self.shared = 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key, loader: Callable[[], Awaitable[Any]]):
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        # bumped on every invalidation; a load that started before a bump must
+        # not store its (possibly stale) result
+        self._gen = 0
+        self.hits = 0
+        self.misses = 0
+        self._flights = SingleFlight()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        item = self._data.get(key, _MISSING)
+        if item is _MISSING:
+            self.misses += 1
+            return default
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, gen: int | None = None):
+        if gen is not None and gen != self._gen:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    @property
+    def generation(self) -> int:
+        return self._gen
+
+    async def get_or_load(self, key, loader):
+        """Cached value, or the loader's result; concurrent misses on one key
+        wait for a single load. Loads started before an invalidation are not
+        joined by later callers."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        gen = self._gen
+
+        async def load():
+            value = await loader()
+            if value is not None:
+                self.set(key, value, gen=gen)
+            return value
+
+        return await self._flights.do((gen, key), load)
+
+    def pop(self, key):
+        self._gen += 1
+        self._data.pop(key, None)
+
+    def pop_prefix(self, prefix: tuple):
+        """Drop every tuple key that starts with `prefix`."""
+        self._gen += 1
+        n = len(prefix)
+        for key in [k for k in self._data if k[:n] == prefix]:
+            del self._data[key]
+
+    def pop_first(self, firsts: set):
+        """Drop every tuple key whose first item is in `firsts`, in one pass
+        (pop_prefix per item would scan the whole cache for each)."""
+        self._gen += 1
+        for key in [k for k in self._data if k[0] in firsts]:
+            del self._data[key]
+
+    def clear(self):
+        self._gen += 1
+        self._data.clear()
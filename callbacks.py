@@ -0,0 +1,154 @@
+"""Callback data for every inline button, and the router that dispatches them.
+
+Buttons are packed with aiogram CallbackData classes (`Page(anime_id=1,
+season_no=2, start=31).pack()` -> "p:1:2:31"), so keyboards and handlers share
+one definition. Instead of one filter per handler, which aiogram would try in
+order for every callback, a single handler looks the prefix up in a dict and
+passes the parsed `callback_data` on.
+"""
+import inspect
+import logging
+from typing import Any, Awaitable, Callable
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery
+
+log = logging.getLogger(__name__)
+
+
+# ---------- public ----------
+class Noop(CallbackData, prefix="noop"):
+    pass
+
+
+class Back(CallbackData, prefix="back"):
+    anime_id: int
+
+
+class Season(CallbackData, prefix="s"):
+    anime_id: int
+    season_no: int
+
+
+class Page(CallbackData, prefix="p"):
+    anime_id: int
+    season_no: int
+    start: int
+
+
+class Jump(CallbackData, prefix="j"):
+    anime_id: int
+    season_no: int
+
+
+class Episode(CallbackData, prefix="e"):
+    anime_id: int
+    season_no: int
+    episode_no: int
+
+
+class OpenAnime(CallbackData, prefix="o"):
+    anime_id: int
+
+
+class BrowseHome(CallbackData, prefix="bh"):
+    within: int  # value id chosen so far, 0 = none
+
+
+class BrowseFacet(CallbackData, prefix="bf"):
+    facet: str
+    within: int
+    offset: int
+
+
+class BrowseValue(CallbackData, prefix="bv"):
+    value_id: int
+    within: int
+    after: int  # last anime id of the previous page
+
+
+class Top(CallbackData, prefix="top"):
+    board: str
+
+
+# ---------- admin ----------
+class Admin(CallbackData, prefix="admin"):
+    """Admin menu entries; routed by `action`."""
+    action: str
+
+
+class AddSeason(CallbackData, prefix="addseason"):
+    anime_id: int
+
+
+class EditEpisodes(CallbackData, prefix="editep"):
+    anime_id: int
+    season_no: int
+
+
+class BroadcastAction(CallbackData, prefix="bc"):
+    action: str
+    broadcast_id: int
+
+
+Handler = Callable[..., Awaitable[Any]]
+
+
+def _source_of(fn: Handler) -> tuple:
+    code = getattr(fn, "__code__", None)
+    return fn.__qualname__, code.co_filename if code else None, code.co_firstlineno if code else None
+
+
+class CallbackRouter:
+    """Prefix -> handler table. Classes with an `action` field are routed on
+    "prefix:action", so each admin menu entry gets its own handler."""
+
+    def __init__(self):
+        self._routes: dict[str, tuple[type[CallbackData], Handler, frozenset | None]] = {}
+
+    def __call__(self, cb: type[CallbackData], action: str | None = None):
+        key = cb.__prefix__ if action is None else f"{cb.__prefix__}{cb.__separator__}{action}"
+
+        def register(fn: Handler) -> Handler:
+            old = self._routes.get(key)
+            # the same definition loaded twice (a module imported under two
+            # names) replaces itself; a different handler is a mistake
+            if old is not None and _source_of(old[1]) != _source_of(fn):
+                raise ValueError(f"callback {key!r} is already routed to {old[1].__name__}")
+            params = inspect.signature(fn).parameters
+            accepts_all = any(p.kind is p.VAR_KEYWORD for p in params.values())
+            self._routes[key] = (cb, fn, None if accepts_all else frozenset(params))
+            return fn
+
+        return register
+
+    def key_of(self, data: str) -> str | None:
+        """The routed "prefix" or "prefix:action" that `data` belongs to."""
+        prefix, _, rest = data.partition(":")
+        if prefix in self._routes:
+            return prefix
+        key = f"{prefix}:{rest.partition(':')[0]}"
+        return key if rest and key in self._routes else None
+
+    def route(self, data: str) -> tuple[type[CallbackData], Handler, frozenset | None] | None:
+        key = self.key_of(data)
+        return self._routes[key] if key is not None else None
+
+    async def dispatch(self, call: CallbackQuery, **data: Any) -> Any:
+        """The one callback_query handler registered on the dispatcher."""
+        found = self.route(call.data or "")
+        if found is None:
+            return call.answer()
+        cb, fn, params = found
+        try:
+            data["callback_data"] = cb.unpack(call.data)
+        except (TypeError, ValueError):
+            # a button from an older version of the bot
+            log.debug("unparsable callback data %r", call.data)
+            return call.answer("Bu tugma eskirgan.")
+        if params is not None:
+            data = {k: v for k, v in data.items() if k in params}
+        return await fn(call, **data)
+
+
+router = CallbackRouter()
@@ -1 +1,1360 @@
-DB_PATH = "data.db"
\ No newline at end of file
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, NamedTuple
+
+import aiosqlite
+
+from cache import TTLCache
+from fileid import media_type_of
+from textnorm import facet_key, fold, tokens
+
+DB_PATH = "data.db"
+
+# Long-lived connections: N readers (WAL lets them run in parallel with the
+# writer) and one writer that serializes every mutation behind a lock.
+READERS = 4
+STATEMENT_CACHE = 256
+
+# Catalogue data changes only through the admin write paths below, each of
+# which drops exactly the entries it touched.
+anime_cache = TTLCache(maxsize=4096, ttl=600)
+season_cache = TTLCache(maxsize=4096, ttl=600)
+page_cache = TTLCache(maxsize=8192, ttl=300)
+episode_cache = TTLCache(maxsize=16384, ttl=600)
+# (facet, within value id, offset, limit) -> [(value id, label, count)]
+facet_cache = TTLCache(maxsize=1024, ttl=300)
+# (folded query, offset, limit) -> results; dropped whenever an anime row changes
+search_cache = TTLCache(maxsize=4096, ttl=120)
+
+# Per-anime change counter. Anything derived from an anime's rows (rendered
+# menus, ...) stores the version it was built from instead of being
+# invalidated explicitly.
+_versions: dict[int, int] = {}
+# lock code -> anime id (and back) for every locked title, so guessing a code
+# never reaches the database
+_lock_codes: dict[str, int] = {}
+_code_of: dict[int, str] = {}
+# (user_id, anime_id) -> code the user unlocked it with. Only a match is
+# trusted: a miss or an old code is read again from `unlocks`, so an unlock
+# recorded by another process (webhook instance, worker) counts at once
+unlock_cache = TTLCache(maxsize=65536, ttl=3600)
+_last_change_seq = 0
+CHANGES_KEEP = 10000
+DAY = 86400  # statistics buckets are UTC days
+
+ANIME_FIELDS = {"title", "year", "country", "language", "genres", "description"}
+IMPORT_FIELDS = ("title", "year", "country", "language", "genres", "description")
+BROADCAST_FIELDS = {"progress_msg", "status", "last_user_id", "ok", "blocked", "failed"}
+# browse facet -> anime column it is read from
+FACETS = {"genre": "genres", "year": "year", "country": "country", "language": "language"}
+_FACET_SPLIT = re.compile(r"[,;/|]+")
+# bump when facet keys are computed differently; init_db then rebuilds the index
+FACET_INDEX_VERSION = 2
+SEARCH_FIELDS = ("title", "genres", "country", "language", "description")
+# relevance weight per field, same order as SEARCH_FIELDS
+SEARCH_WEIGHTS = (10.0, 3.0, 1.0, 1.0, 0.5)
+# FTS matches scored per search. Titles starting with the query come from
+# title_keys and are never cut off; other matches of a word found all over
+# the catalogue are only looked for among the newest SEARCH_CANDIDATES, since
+# any ranking over all of them (bm25 included) costs a row per match.
+SEARCH_CANDIDATES = 200
+# bump when fold()/tokens() change; init_db then rebuilds the search index
+SEARCH_INDEX_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id    INTEGER PRIMARY KEY,
+    first_seen INTEGER NOT NULL,
+    last_seen  INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS anime (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    title       TEXT NOT NULL,
+    year        TEXT NOT NULL DEFAULT '',
+    country     TEXT NOT NULL DEFAULT '',
+    language    TEXT NOT NULL DEFAULT '',
+    genres      TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    is_locked   INTEGER NOT NULL DEFAULT 0,
+    lock_code   TEXT NOT NULL DEFAULT ''
+);
+
+CREATE INDEX IF NOT EXISTS idx_anime_lock_code ON anime(lock_code) WHERE is_locked = 1;
+
+CREATE TABLE IF NOT EXISTS seasons (
+    anime_id      INTEGER NOT NULL REFERENCES anime(id) ON DELETE CASCADE,
+    season_no     INTEGER NOT NULL,
+    episode_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (anime_id, season_no)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS episodes (
+    anime_id   INTEGER NOT NULL,
+    season_no  INTEGER NOT NULL,
+    episode_no INTEGER NOT NULL,
+    file_id    TEXT NOT NULL,
+    caption    TEXT NOT NULL DEFAULT '',
+    media_type TEXT NOT NULL DEFAULT '',  -- video | document | '' (unknown)
+    duration   INTEGER,
+    file_size  INTEGER,
+    PRIMARY KEY (anime_id, season_no, episode_no),
+    FOREIGN KEY (anime_id, season_no) REFERENCES seasons(anime_id, season_no) ON DELETE CASCADE
+);
+
+-- the primary key is the (anime_id, season_no, episode_no) index every
+-- episode listing walks; seasons.episode_count saves a COUNT(*) per page
+CREATE TRIGGER IF NOT EXISTS trg_episodes_count_ins AFTER INSERT ON episodes BEGIN
+    UPDATE seasons SET episode_count = episode_count + 1
+    WHERE anime_id = NEW.anime_id AND season_no = NEW.season_no;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_episodes_count_del AFTER DELETE ON episodes BEGIN
+    UPDATE seasons SET episode_count = episode_count - 1
+    WHERE anime_id = OLD.anime_id AND season_no = OLD.season_no;
+END;
+
+-- rowid = anime.id; columns hold textnorm.fold()ed text so Latin/Cyrillic
+-- and apostrophe variants of the same word index to the same token
+CREATE VIRTUAL TABLE IF NOT EXISTS anime_fts USING fts5(
+    title, genres, country, language, description,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+-- the title's folded tokens joined by spaces: "titles starting with the
+-- query" is a bounded range scan in key order, the exact title first
+CREATE TABLE IF NOT EXISTS title_keys (
+    anime_id INTEGER PRIMARY KEY,
+    key      TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_title_keys_key ON title_keys(key);
+
+-- catalogue writes, so other worker processes can drop their cached copies
+CREATE TABLE IF NOT EXISTS catalog_changes (
+    seq      INTEGER PRIMARY KEY AUTOINCREMENT,
+    anime_id INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload      TEXT NOT NULL,
+    active_since INTEGER,
+    admin_chat   INTEGER NOT NULL,
+    progress_msg INTEGER,
+    status       TEXT NOT NULL DEFAULT 'running',
+    total        INTEGER NOT NULL DEFAULT 0,
+    last_user_id INTEGER NOT NULL DEFAULT 0,
+    ok           INTEGER NOT NULL DEFAULT 0,
+    blocked      INTEGER NOT NULL DEFAULT 0,
+    failed       INTEGER NOT NULL DEFAULT 0,
+    created_at   INTEGER NOT NULL,
+    owner        TEXT,     -- process running it (broadcast.OWNER), NULL = nobody
+    heartbeat    INTEGER   -- last sign of life from owner
+);
+
+-- ---------- browsing ----------
+-- one row per distinct facet value (value = textnorm.facet_key(label)); `count`
+-- is kept by the triggers below so value lists never count anime rows
+CREATE TABLE IF NOT EXISTS facet_values (
+    id    INTEGER PRIMARY KEY,
+    facet TEXT NOT NULL,
+    value TEXT NOT NULL,
+    label TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (facet, value)
+);
+
+CREATE TABLE IF NOT EXISTS anime_facets (
+    value_id INTEGER NOT NULL REFERENCES facet_values(id),
+    anime_id INTEGER NOT NULL,
+    PRIMARY KEY (value_id, anime_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_anime_facets_anime ON anime_facets(anime_id);
+
+CREATE TRIGGER IF NOT EXISTS trg_anime_facets_ins AFTER INSERT ON anime_facets BEGIN
+    UPDATE facet_values SET count = count + 1 WHERE id = NEW.value_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_anime_facets_del AFTER DELETE ON anime_facets BEGIN
+    UPDATE facet_values SET count = count - 1 WHERE id = OLD.value_id;
+END;
+
+-- the last episode each user opened per title, for "continue watching"
+CREATE TABLE IF NOT EXISTS watch_progress (
+    user_id    INTEGER NOT NULL,
+    anime_id   INTEGER NOT NULL,
+    season_no  INTEGER NOT NULL,
+    episode_no INTEGER NOT NULL,
+    watched_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, anime_id)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_watch_progress_recent ON watch_progress(user_id, watched_at);
+
+-- titles a user opened with their code; only valid while the code is unchanged
+CREATE TABLE IF NOT EXISTS unlocks (
+    user_id     INTEGER NOT NULL,
+    anime_id    INTEGER NOT NULL,
+    code        TEXT NOT NULL,
+    unlocked_at INTEGER NOT NULL,
+    PRIMARY KEY (user_id, anime_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS fsm (
+    key   TEXT PRIMARY KEY,
+    state TEXT,
+    data  TEXT NOT NULL DEFAULT '{}'
+) WITHOUT ROWID;
+
+-- ---------- statistics ----------
+-- table row counts kept by triggers, so the stats panel never scans
+CREATE TABLE IF NOT EXISTS counters (
+    name  TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+-- versions of derived data (e.g. the facet index); a stale one is rebuilt at startup
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- per UTC day (unixtime / 86400): users seen that day and first-time users
+CREATE TABLE IF NOT EXISTS daily_activity (
+    day       INTEGER PRIMARY KEY,
+    active    INTEGER NOT NULL DEFAULT 0,
+    new_users INTEGER NOT NULL DEFAULT 0
+);
+
+-- views = episode deliveries, opens = deep-link /start opens
+CREATE TABLE IF NOT EXISTS daily_views (
+    day      INTEGER NOT NULL,
+    anime_id INTEGER NOT NULL,
+    views    INTEGER NOT NULL DEFAULT 0,
+    opens    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, anime_id)
+) WITHOUT ROWID;
+
+-- top-N lists rebuilt by refresh_rankings(); menus read one board's rows
+CREATE TABLE IF NOT EXISTS rankings (
+    board    TEXT NOT NULL,
+    rank     INTEGER NOT NULL,
+    anime_id INTEGER NOT NULL,
+    score    REAL NOT NULL,
+    PRIMARY KEY (board, rank)
+) WITHOUT ROWID;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_ins AFTER INSERT ON users BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'users';
+    INSERT INTO daily_activity(day, active, new_users) VALUES (NEW.last_seen / 86400, 1, 1)
+        ON CONFLICT(day) DO UPDATE SET active = active + 1, new_users = new_users + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_del AFTER DELETE ON users BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'users';
+END;
+
+-- last_seen only moves forward, so a user is counted once per day
+CREATE TRIGGER IF NOT EXISTS trg_users_seen AFTER UPDATE OF last_seen ON users
+WHEN NEW.last_seen / 86400 > OLD.last_seen / 86400 BEGIN
+    INSERT INTO daily_activity(day, active) VALUES (NEW.last_seen / 86400, 1)
+        ON CONFLICT(day) DO UPDATE SET active = active + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_anime_ins AFTER INSERT ON anime BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'anime';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_anime_del AFTER DELETE ON anime BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'anime';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_episodes_ins AFTER INSERT ON episodes BEGIN
+    UPDATE counters SET value = value + 1 WHERE name = 'episodes';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_episodes_del AFTER DELETE ON episodes BEGIN
+    UPDATE counters SET value = value - 1 WHERE name = 'episodes';
+END;
+
+-- seeded with one real count the first time; the triggers keep them from then on
+INSERT INTO counters(name, value) SELECT 'users', (SELECT COUNT(*) FROM users)
+    WHERE NOT EXISTS (SELECT 1 FROM counters WHERE name = 'users');
+INSERT INTO counters(name, value) SELECT 'anime', (SELECT COUNT(*) FROM anime)
+    WHERE NOT EXISTS (SELECT 1 FROM counters WHERE name = 'anime');
+INSERT INTO counters(name, value) SELECT 'episodes', (SELECT COUNT(*) FROM episodes)
+    WHERE NOT EXISTS (SELECT 1 FROM counters WHERE name = 'episodes');
+"""
+
+# columns added after the first release: (table, column, declaration, SQL filling existing rows)
+MIGRATIONS = (
+    ("episodes", "media_type", "TEXT NOT NULL DEFAULT ''", None),
+    ("episodes", "duration", "INTEGER", None),
+    ("episodes", "file_size", "INTEGER", None),
+    ("daily_views", "opens", "INTEGER NOT NULL DEFAULT 0", None),
+    ("broadcasts", "owner", "TEXT", None),
+    ("broadcasts", "heartbeat", "INTEGER", None),
+    ("seasons", "episode_count", "INTEGER NOT NULL DEFAULT 0",
+     "UPDATE seasons SET episode_count = (SELECT COUNT(*) FROM episodes e "
+     "WHERE e.anime_id = seasons.anime_id AND e.season_no = seasons.season_no)"),
+)
+
+
+class Media(NamedTuple):
+    file_id: str
+    media_type: str = ""
+    duration: int | None = None
+    file_size: int | None = None
+
+
+_writer: aiosqlite.Connection | None = None
+_write_lock = asyncio.Lock()
+_readers: asyncio.Queue | None = None
+_reader_conns: list[aiosqlite.Connection] = []
+
+
+# ---------- POOL ----------
+async def _connect(path: str, readonly: bool = False) -> aiosqlite.Connection:
+    # cached_statements keeps compiled statements per connection, so the
+    # constant SQL strings below are prepared once and reused.
+    conn = await aiosqlite.connect(path, cached_statements=STATEMENT_CACHE)
+    conn.row_factory = aiosqlite.Row
+    await conn.execute("PRAGMA journal_mode=WAL")
+    await conn.execute("PRAGMA synchronous=NORMAL")
+    await conn.execute("PRAGMA busy_timeout=5000")
+    await conn.execute("PRAGMA foreign_keys=ON")
+    if readonly:
+        await conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+async def init_db(path: str | None = None, readers: int = READERS):
+    global _writer, _readers, DB_PATH
+    if _writer is not None:
+        return
+    if path:
+        DB_PATH = path
+
+    _writer = await _connect(DB_PATH)
+    await _migrate(_writer)
+    await _writer.executescript(SCHEMA)
+    await _writer.commit()
+    await _sync_search_index()
+    await _sync_facets()
+
+    global _last_change_seq
+    async with _writer.execute("SELECT COALESCE(MAX(seq), 0) FROM catalog_changes") as cur:
+        _last_change_seq = (await cur.fetchone())[0]
+    _lock_codes.clear()
+    _code_of.clear()
+    async with _writer.execute("SELECT id, lock_code FROM anime WHERE is_locked = 1") as cur:
+        for anime_id, code in await cur.fetchall():
+            _set_lock_code(anime_id, code)
+
+    _readers = asyncio.Queue()
+    for _ in range(max(1, readers)):
+        conn = await _connect(DB_PATH, readonly=True)
+        _reader_conns.append(conn)
+        _readers.put_nowait(conn)
+
+
+async def _migrate(conn: aiosqlite.Connection):
+    for table, column, decl, fill in MIGRATIONS:
+        async with conn.execute(f"PRAGMA table_info({table})") as cur:
+            cols = {r[1] for r in await cur.fetchall()}
+        if cols and column not in cols:
+            await conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            if fill:
+                await conn.execute(fill)
+    await conn.commit()
+
+
+async def close_db():
+    global _writer, _readers
+    for conn in _reader_conns:
+        await conn.close()
+    _reader_conns.clear()
+    _readers = None
+    if _writer is not None:
+        await _writer.close()
+        _writer = None
+
+
+@asynccontextmanager
+async def reading():
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
+
+@asynccontextmanager
+async def writing():
+    async with _write_lock:
+        try:
+            yield _writer
+        except BaseException:
+            await _writer.rollback()
+            raise
+        await _writer.commit()
+
+
+async def _fetchone(sql: str, params=()) -> aiosqlite.Row | None:
+    async with reading() as conn:
+        async with conn.execute(sql, params) as cur:
+            return await cur.fetchone()
+
+
+async def _fetchall(sql: str, params=()) -> list[aiosqlite.Row]:
+    async with reading() as conn:
+        async with conn.execute(sql, params) as cur:
+            return await cur.fetchall()
+
+
+async def _fetchval(sql: str, params=(), default=None):
+    row = await _fetchone(sql, params)
+    return row[0] if row is not None and row[0] is not None else default
+
+
+def anime_version(anime_id: int) -> int:
+    return _versions.get(anime_id, 0)
+
+
+def _touch(anime_id: int):
+    _versions[anime_id] = _versions.get(anime_id, 0) + 1
+
+
+async def _log_change(conn: aiosqlite.Connection, anime_id: int):
+    await conn.execute("INSERT INTO catalog_changes(anime_id) VALUES (?)", (anime_id,))
+
+
+def _forget_anime(anime_ids: set[int]):
+    for anime_id in anime_ids:
+        anime_cache.pop(anime_id)
+        season_cache.pop(anime_id)
+        _touch(anime_id)
+    page_cache.pop_first(anime_ids)
+    episode_cache.pop_first(anime_ids)
+
+
+async def sync_changes() -> int:
+    """Drop cached data for anime changed by any process since the last call.
+
+    Picks up writes from other processes sharing the database (workers,
+    importer.py); returns the number of anime invalidated.
+    """
+    global _last_change_seq
+    rows = await _fetchall(
+        "SELECT seq, anime_id FROM catalog_changes WHERE seq > ? ORDER BY seq", (_last_change_seq,)
+    )
+    if not rows:
+        return 0
+    _last_change_seq = rows[-1][0]
+    changed = {r[1] for r in rows}
+    _forget_anime(changed)
+    search_cache.clear()
+    facet_cache.clear()
+    marks = ",".join("?" * len(changed))
+    locks = {r[0]: r[1] for r in await _fetchall(
+        f"SELECT id, lock_code FROM anime WHERE is_locked = 1 AND id IN ({marks})", tuple(changed)
+    )}
+    for anime_id in changed:
+        _set_lock_code(anime_id, locks.get(anime_id, ""))
+    return len(changed)
+
+
+async def prune_changes():
+    async with writing() as conn:
+        await conn.execute(
+            "DELETE FROM catalog_changes WHERE seq <= (SELECT MAX(seq) FROM catalog_changes) - ?",
+            (CHANGES_KEEP,),
+        )
+
+
+# ---------- SEARCH ----------
+def _search_row(a: dict) -> tuple:
+    return tuple(fold(a.get(f) or "") for f in SEARCH_FIELDS)
+
+
+def _title_key(text: str) -> str:
+    return " ".join(tokens(text))
+
+
+async def _index_title(conn: aiosqlite.Connection, anime_id: int, title: str):
+    await conn.execute(
+        "INSERT OR REPLACE INTO title_keys(anime_id, key) VALUES (?, ?)", (anime_id, _title_key(title))
+    )
+
+
+# ---------- FACETS ----------
+def _facet_labels(facet: str, text: str) -> dict[str, str]:
+    """key -> label for one anime field, e.g. genres "Drama, komediya"
+    -> {"drama": "Drama", "komediya": "komediya"}. Years are kept verbatim."""
+    parts = [text] if facet == "year" else _FACET_SPLIT.split(text or "")
+    out = {}
+    for part in parts:
+        label = " ".join(part.split())
+        key = label if facet == "year" else facet_key(label)
+        if key and key not in out:
+            out[key] = label
+    return out
+
+
+async def _index_facets(conn: aiosqlite.Connection, anime_id: int, a: dict, facets=tuple(FACETS)):
+    for facet in facets:
+        await conn.execute(
+            "DELETE FROM anime_facets WHERE anime_id = ? AND value_id IN (SELECT id FROM facet_values WHERE facet = ?)",
+            (anime_id, facet),
+        )
+        for key, label in _facet_labels(facet, a.get(FACETS[facet]) or "").items():
+            await conn.execute(
+                "INSERT INTO facet_values(facet, value, label) VALUES (?, ?, ?) ON CONFLICT(facet, value) DO NOTHING",
+                (facet, key, label),
+            )
+            await conn.execute(
+                "INSERT OR IGNORE INTO anime_facets(value_id, anime_id) "
+                "SELECT id, ? FROM facet_values WHERE facet = ? AND value = ?",
+                (anime_id, facet, key),
+            )
+
+
+async def _sync_facets():
+    """Rebuild the facet index when it is older than FACET_INDEX_VERSION
+    (or missing, for anime stored before browsing existed)."""
+    async with writing() as conn:
+        async with conn.execute("SELECT value FROM meta WHERE key = 'facet_index'") as cur:
+            row = await cur.fetchone()
+        if row and row[0] >= FACET_INDEX_VERSION:
+            return
+        # the marker used to be a counters row, where stats() listed it
+        await conn.execute("DELETE FROM counters WHERE name = 'facet_index'")
+        await conn.execute("DELETE FROM anime_facets")
+        await conn.execute("DELETE FROM facet_values")
+        async with conn.execute("SELECT * FROM anime") as cur:
+            rows = await cur.fetchall()
+        for row in rows:
+            await _index_facets(conn, row["id"], dict(row))
+        await conn.execute(
+            "INSERT INTO meta(key, value) VALUES ('facet_index', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (FACET_INDEX_VERSION,),
+        )
+
+
+async def _load_facet_values(facet: str, within: int, offset: int, limit: int) -> list[tuple[int, str, int]]:
+    order = "v.value DESC" if facet == "year" else "n DESC, v.label"
+    if not within:
+        sql = (f"SELECT v.id, v.label, v.count AS n FROM facet_values v WHERE v.facet = ? AND v.count > 0 "
+               f"ORDER BY {order} LIMIT ? OFFSET ?")
+        params = (facet, limit, offset)
+    else:
+        # values co-occurring with an already chosen one: walks that value's
+        # anime only, never the whole catalogue
+        sql = ("SELECT v.id, v.label, COUNT(*) AS n FROM anime_facets base "
+               "JOIN anime_facets f ON f.anime_id = base.anime_id "
+               "JOIN facet_values v ON v.id = f.value_id "
+               f"WHERE base.value_id = ? AND v.facet = ? AND v.id != ? GROUP BY v.id ORDER BY {order} LIMIT ? OFFSET ?")
+        params = (within, facet, within, limit, offset)
+    return [tuple(r) for r in await _fetchall(sql, params)]
+
+
+async def facet_values(facet: str, within: int = 0, offset: int = 0, limit: int = 30) -> list[tuple[int, str, int]]:
+    """[(value id, label, anime count)] for `facet`, optionally only among
+    anime that also have value `within`."""
+    key = (facet, within, offset, limit)
+    return await facet_cache.get_or_load(key, lambda: _load_facet_values(facet, within, offset, limit))
+
+
+async def get_facet_value(value_id: int) -> dict | None:
+    row = await _fetchone("SELECT id, facet, label, count FROM facet_values WHERE id = ?", (value_id,))
+    return dict(row) if row else None
+
+
+async def browse_anime(value_id: int, within: int = 0, after: int = 0, limit: int = 20) -> list[tuple[int, str]]:
+    """Keyset page of (anime id, title) having `value_id` (and `within`, if set)."""
+    if not within:
+        sql = ("SELECT a.id, a.title FROM anime_facets f JOIN anime a ON a.id = f.anime_id "
+               "WHERE f.value_id = ? AND f.anime_id > ? ORDER BY f.anime_id LIMIT ?")
+        params = (value_id, after, limit)
+    else:
+        sql = ("SELECT a.id, a.title FROM anime_facets f "
+               "JOIN anime_facets w ON w.value_id = ? AND w.anime_id = f.anime_id "
+               "JOIN anime a ON a.id = f.anime_id "
+               "WHERE f.value_id = ? AND f.anime_id > ? ORDER BY f.anime_id LIMIT ?")
+        params = (within, value_id, after, limit)
+    return [tuple(r) for r in await _fetchall(sql, params)]
+
+
+async def _sync_search_index():
+    async with writing() as conn:
+        async with conn.execute(
+            "SELECT (SELECT COUNT(*) FROM anime), (SELECT COUNT(*) FROM anime_fts), "
+            "(SELECT COUNT(*) FROM title_keys), (SELECT value FROM meta WHERE key = 'search_index')"
+        ) as cur:
+            n_anime, n_fts, n_keys, version = await cur.fetchone()
+        if n_anime == n_fts == n_keys and (version or 0) >= SEARCH_INDEX_VERSION:
+            return
+        await conn.execute("DELETE FROM anime_fts")
+        await conn.execute("DELETE FROM title_keys")
+        async with conn.execute("SELECT * FROM anime") as cur:
+            async for row in cur:
+                await conn.execute(
+                    "INSERT INTO anime_fts(rowid, title, genres, country, language, description) VALUES (?, ?, ?, ?, ?, ?)",
+                    (row["id"], *_search_row(dict(row))),
+                )
+                await _index_title(conn, row["id"], row["title"])
+        await conn.execute(
+            "INSERT INTO meta(key, value) VALUES ('search_index', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (SEARCH_INDEX_VERSION,),
+        )
+
+
+def _match_expr(toks: list[str]) -> str:
+    # every word must match, each as a prefix of an indexed token
+    return " ".join(f'"{t}"*' for t in toks)
+
+
+async def _title_prefix(key: str, n: int) -> list[int]:
+    # titles that start with the query (its last word may be cut short), in key order
+    rows = await _fetchall(
+        "SELECT anime_id FROM title_keys WHERE key >= ? AND key < ? ORDER BY key LIMIT ?",
+        (key, key + "\U0010ffff", n),
+    )
+    return [r[0] for r in rows]
+
+
+def _relevance(toks: tuple[str, ...], columns) -> float:
+    # per field: share of its words that start with a query word, weighted
+    score = 0.0
+    for weight, text in zip(SEARCH_WEIGHTS, columns):
+        words = text.split()
+        if words:
+            score += weight * sum(1 for w in words if w.startswith(toks)) / len(words)
+    return score
+
+
+async def _ranked(toks: list[str]) -> list[int]:
+    # the newest SEARCH_CANDIDATES matches (FTS walks rowids in order), best
+    # first. Whole-word matches stream cheaply; the prefix form, which reads a
+    # word's entire match list, only runs when they don't fill the candidates.
+    sql = (f"SELECT rowid, {', '.join(SEARCH_FIELDS)} FROM anime_fts "
+           "WHERE anime_fts MATCH ? ORDER BY rowid DESC LIMIT ?")
+    rows = {r[0]: tuple(r)[1:] for r in await _fetchall(sql, (" ".join(f'"{t}"' for t in toks), SEARCH_CANDIDATES))}
+    if len(rows) < SEARCH_CANDIDATES:
+        for r in await _fetchall(sql, (_match_expr(toks), SEARCH_CANDIDATES)):
+            rows.setdefault(r[0], tuple(r)[1:])
+    prefixes = tuple(toks)
+    return sorted(rows, key=lambda i: (-_relevance(prefixes, rows[i]), -i))
+
+
+async def _load_search(toks: list[str], limit: int, offset: int) -> list[dict]:
+    # titles starting with the query first, then the other matches; the
+    # FTS pass runs only if the title prefixes don't fill the page
+    n = offset + limit
+    ids = await _title_prefix(" ".join(toks), n)
+    if len(ids) < n:
+        seen = set(ids)
+        ids += [i for i in await _ranked(toks) if i not in seen]
+    ids = ids[offset:n]
+    if not ids:
+        return []
+    rows = await _fetchall(f"SELECT * FROM anime WHERE id IN ({','.join('?' * len(ids))})", tuple(ids))
+    by_id = {r["id"]: dict(r) for r in rows}
+    return [by_id[i] for i in ids if i in by_id]
+
+
+async def search_anime(q: str, limit: int = 20, offset: int = 0) -> list[dict]:
+    """Anime rows best match first. Every title starting with the query is
+    found; other matches are incomplete for common words, as only the newest
+    SEARCH_CANDIDATES of them are ranked. Identical queries within
+    search_cache's ttl (e.g. inline mode re-sending as the user types) are
+    served from memory."""
+    toks = tokens(q)
+    if not toks:
+        return []
+    return await search_cache.get_or_load((tuple(toks), offset, limit), lambda: _load_search(toks, limit, offset))
+
+
+# ---------- USERS ----------
+async def upsert_users(rows: list[tuple[int, int]]):
+    """Record activity: [(user_id, ts), ...] in one transaction."""
+    async with writing() as conn:
+        await conn.executemany(
+            "INSERT INTO users(user_id, first_seen, last_seen) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)",
+            [(user_id, ts, ts) for user_id, ts in rows],
+        )
+
+
+async def count_users(active_since: int | None = None) -> int:
+    if active_since is None:
+        return await _fetchval("SELECT COUNT(*) FROM users", default=0)
+    return await _fetchval("SELECT COUNT(*) FROM users WHERE last_seen >= ?", (active_since,), default=0)
+
+
+async def user_ids_after(after_id: int, limit: int, active_since: int | None = None) -> list[int]:
+    """Next chunk of user ids in id order (keyset), optionally only users seen since `active_since`."""
+    if active_since is None:
+        rows = await _fetchall(
+            "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after_id, limit)
+        )
+    else:
+        rows = await _fetchall(
+            "SELECT user_id FROM users WHERE user_id > ? AND last_seen >= ? ORDER BY user_id LIMIT ?",
+            (after_id, active_since, limit),
+        )
+    return [r[0] for r in rows]
+
+
+async def delete_users(user_ids: list[int]):
+    async with writing() as conn:
+        await conn.executemany("DELETE FROM users WHERE user_id = ?", [(u,) for u in user_ids])
+
+
+# ---------- BROADCASTS ----------
+async def create_broadcast(payload: str, admin_chat: int, active_since: int | None, total: int) -> int:
+    async with writing() as conn:
+        cur = await conn.execute(
+            "INSERT INTO broadcasts(payload, admin_chat, active_since, total, created_at) VALUES (?, ?, ?, ?, ?)",
+            (payload, admin_chat, active_since, total, int(time.time())),
+        )
+        return cur.lastrowid
+
+
+async def get_broadcast(broadcast_id: int) -> dict | None:
+    row = await _fetchone("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+    return dict(row) if row else None
+
+
+async def running_broadcasts() -> list[dict]:
+    rows = await _fetchall("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+    return [dict(r) for r in rows]
+
+
+async def claim_broadcast(broadcast_id: int, owner: str, stale_after: int) -> bool:
+    """Make `owner` the one process running a broadcast. Fails while another
+    owner has sent a heartbeat within `stale_after` seconds."""
+    now = int(time.time())
+    async with writing() as conn:
+        cur = await conn.execute(
+            "UPDATE broadcasts SET owner = ?, heartbeat = ? WHERE id = ? AND status = 'running' "
+            "AND (owner IS NULL OR owner = ? OR heartbeat < ?)",
+            (owner, now, broadcast_id, owner, now - stale_after),
+        )
+        return cur.rowcount == 1
+
+
+async def touch_broadcast(broadcast_id: int, owner: str) -> bool:
+    """Refresh the heartbeat; False once the claim has been taken over."""
+    async with writing() as conn:
+        cur = await conn.execute(
+            "UPDATE broadcasts SET heartbeat = ? WHERE id = ? AND owner = ?",
+            (int(time.time()), broadcast_id, owner),
+        )
+        return cur.rowcount == 1
+
+
+async def release_broadcast(broadcast_id: int, owner: str):
+    async with writing() as conn:
+        await conn.execute("UPDATE broadcasts SET owner = NULL WHERE id = ? AND owner = ?", (broadcast_id, owner))
+
+
+async def update_broadcast(broadcast_id: int, **fields):
+    if not fields.keys() <= BROADCAST_FIELDS:
+        raise ValueError(f"unknown broadcast fields: {set(fields) - BROADCAST_FIELDS}")
+    cols = ", ".join(f"{k} = ?" for k in fields)
+    async with writing() as conn:
+        await conn.execute(f"UPDATE broadcasts SET {cols} WHERE id = ?", (*fields.values(), broadcast_id))
+
+
+# ---------- ANIME ----------
+async def add_anime(title: str, year: str = "", country: str = "", language: str = "",
+                    genres: str = "", description: str = "") -> int:
+    async with writing() as conn:
+        cur = await conn.execute(
+            "INSERT INTO anime(title, year, country, language, genres, description) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (title, year, country, language, genres, description),
+        )
+        anime_id = cur.lastrowid
+        await conn.execute(
+            "INSERT INTO anime_fts(rowid, title, genres, country, language, description) VALUES (?, ?, ?, ?, ?, ?)",
+            (anime_id, *_search_row(dict(title=title, genres=genres, country=country,
+                                         language=language, description=description))),
+        )
+        await _index_title(conn, anime_id, title)
+        await _index_facets(conn, anime_id, dict(year=year, country=country, language=language, genres=genres))
+        await _log_change(conn, anime_id)
+    search_cache.clear()
+    facet_cache.clear()
+    return anime_id
+
+
+async def _load_anime(anime_id: int) -> dict | None:
+    row = await _fetchone("SELECT * FROM anime WHERE id = ?", (anime_id,))
+    return dict(row) if row else None
+
+
+async def get_anime(anime_id: int) -> dict | None:
+    return await anime_cache.get_or_load(anime_id, lambda: _load_anime(anime_id))
+
+
+def _set_lock_code(anime_id: int, code: str):
+    old = _code_of.pop(anime_id, None)
+    if old is not None and _lock_codes.get(old) == anime_id:
+        del _lock_codes[old]
+    if code:
+        _lock_codes[code] = anime_id
+        _code_of[anime_id] = code
+
+
+def anime_id_by_code(code: str) -> int | None:
+    return _lock_codes.get(code)
+
+
+async def update_anime_field(anime_id: int, field: str, value: str):
+    if field not in ANIME_FIELDS:
+        raise ValueError(f"unknown anime field: {field}")
+    async with writing() as conn:
+        await conn.execute(f"UPDATE anime SET {field} = ? WHERE id = ?", (value, anime_id))
+        await _log_change(conn, anime_id)
+        if field in SEARCH_FIELDS:
+            await conn.execute(f"UPDATE anime_fts SET {field} = ? WHERE rowid = ?", (fold(value), anime_id))
+        if field == "title":
+            await _index_title(conn, anime_id, value)
+        facets = [f for f, column in FACETS.items() if column == field]
+        if facets:
+            await _index_facets(conn, anime_id, {field: value}, facets)
+    anime_cache.pop(anime_id)
+    search_cache.clear()
+    if facets:
+        facet_cache.clear()
+    _touch(anime_id)
+
+
+async def set_anime_lock(anime_id: int, is_locked: int, code: str):
+    async with writing() as conn:
+        await conn.execute(
+            "UPDATE anime SET is_locked = ?, lock_code = ? WHERE id = ?",
+            (1 if is_locked else 0, code if is_locked else "", anime_id),
+        )
+        await _log_change(conn, anime_id)
+    anime_cache.pop(anime_id)
+    search_cache.clear()
+    _set_lock_code(anime_id, code if is_locked else "")
+    _touch(anime_id)
+
+
+async def _load_unlock(user_id: int, anime_id: int) -> str | None:
+    return await _fetchval("SELECT code FROM unlocks WHERE user_id = ? AND anime_id = ?", (user_id, anime_id))
+
+
+async def has_unlocked(user_id: int, anime_id: int, code: str) -> bool:
+    """True if `user_id` opened `anime_id` with `code` (its current code)."""
+    if unlock_cache.get((user_id, anime_id)) == code:
+        return True
+    stored = await _load_unlock(user_id, anime_id)
+    if stored is not None:
+        unlock_cache.set((user_id, anime_id), stored)
+    return stored == code
+
+
+async def record_unlock(user_id: int, anime_id: int, code: str):
+    async with writing() as conn:
+        await conn.execute(
+            "INSERT INTO unlocks(user_id, anime_id, code, unlocked_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id, anime_id) DO UPDATE SET code = excluded.code, unlocked_at = excluded.unlocked_at",
+            (user_id, anime_id, code, int(time.time())),
+        )
+    unlock_cache.set((user_id, anime_id), code)
+
+
+# ---------- SEASONS / EPISODES ----------
+async def ensure_season(anime_id: int, season_no: int):
+    async with writing() as conn:
+        await conn.execute(
+            "INSERT OR IGNORE INTO seasons(anime_id, season_no) VALUES (?, ?)",
+            (anime_id, season_no),
+        )
+        await _log_change(conn, anime_id)
+    season_cache.pop(anime_id)
+    _touch(anime_id)
+
+
+async def _load_seasons(anime_id: int) -> list[int]:
+    rows = await _fetchall(
+        "SELECT season_no FROM seasons WHERE anime_id = ? ORDER BY season_no", (anime_id,)
+    )
+    return [r[0] for r in rows]
+
+
+async def list_seasons(anime_id: int) -> list[int]:
+    return await season_cache.get_or_load(anime_id, lambda: _load_seasons(anime_id))
+
+
+async def count_episodes(anime_id: int, season_no: int) -> int:
+    return await _fetchval(
+        "SELECT episode_count FROM seasons WHERE anime_id = ? AND season_no = ?",
+        (anime_id, season_no),
+        default=0,
+    )
+
+
+async def list_episode_numbers(anime_id: int, season_no: int, start: int = 0, limit: int = 30) -> list[int]:
+    """Up to `limit` episode numbers >= `start` (keyset, no OFFSET scan)."""
+    rows = await _fetchall(
+        "SELECT episode_no FROM episodes WHERE anime_id = ? AND season_no = ? AND episode_no >= ? "
+        "ORDER BY episode_no LIMIT ?",
+        (anime_id, season_no, start, limit),
+    )
+    return [r[0] for r in rows]
+
+
+class EpisodePage(NamedTuple):
+    total: int
+    episodes: list[int]
+    prev_start: int | None  # `start` of the previous page, None on the first one
+    next_start: int | None  # `start` of the next page, None on the last one
+
+
+async def _load_episode_page(anime_id: int, season_no: int, start: int, page_size: int) -> EpisodePage:
+    total = await count_episodes(anime_id, season_no)
+    eps = await list_episode_numbers(anime_id, season_no, start=start, limit=page_size + 1)
+    next_start = None
+    if len(eps) > page_size:
+        eps = eps[:page_size]
+        next_start = eps[-1] + 1
+
+    prev_start = None
+    first = eps[0] if eps else start
+    row = await _fetchone(
+        "SELECT MIN(episode_no), COUNT(*) FROM (SELECT episode_no FROM episodes "
+        "WHERE anime_id = ? AND season_no = ? AND episode_no < ? ORDER BY episode_no DESC LIMIT ?)",
+        (anime_id, season_no, first, page_size),
+    )
+    if row and row[1]:
+        prev_start = row[0]
+    return EpisodePage(total, eps, prev_start, next_start)
+
+
+async def get_episode_page(anime_id: int, season_no: int, start: int = 0, page_size: int = 30) -> EpisodePage:
+    """The page of `page_size` episodes numbered >= `start`."""
+    key = (anime_id, season_no, start, page_size)
+    return await page_cache.get_or_load(key, lambda: _load_episode_page(anime_id, season_no, start, page_size))
+
+
+async def _load_episode_ranges(anime_id: int, season_no: int, block: int) -> list[tuple[int, int]]:
+    return [tuple(r) for r in await _fetchall(
+        "SELECT MIN(episode_no), MAX(episode_no) FROM ("
+        "  SELECT episode_no, (ROW_NUMBER() OVER (ORDER BY episode_no) - 1) / ? AS blk"
+        "  FROM episodes WHERE anime_id = ? AND season_no = ?"
+        ") GROUP BY blk ORDER BY blk",
+        (block, anime_id, season_no),
+    )]
+
+
+async def get_episode_ranges(anime_id: int, season_no: int, block: int) -> list[tuple[int, int]]:
+    """(first, last) episode number of every `block` consecutive episodes; read off the index only."""
+    key = (anime_id, season_no, "ranges", block)
+    return await page_cache.get_or_load(key, lambda: _load_episode_ranges(anime_id, season_no, block))
+
+
+async def last_episode_no(anime_id: int, season_no: int) -> int:
+    return await _fetchval(
+        "SELECT MAX(episode_no) FROM episodes WHERE anime_id = ? AND season_no = ?",
+        (anime_id, season_no),
+        default=0,
+    )
+
+
+class EpisodeRow(NamedTuple):
+    file_id: str
+    caption: str
+    media_type: str
+    next_no: int | None  # following episode of the same season, None after the last
+
+
+async def _load_episode(anime_id: int, season_no: int, episode_no: int) -> EpisodeRow | None:
+    row = await _fetchone(
+        "SELECT file_id, caption, media_type, ("
+        "  SELECT n.episode_no FROM episodes n"
+        "  WHERE n.anime_id = e.anime_id AND n.season_no = e.season_no AND n.episode_no > e.episode_no"
+        "  ORDER BY n.episode_no LIMIT 1"
+        ") FROM episodes e WHERE anime_id = ? AND season_no = ? AND episode_no = ?",
+        (anime_id, season_no, episode_no),
+    )
+    return EpisodeRow(*row) if row else None
+
+
+async def get_episode(anime_id: int, season_no: int, episode_no: int) -> EpisodeRow | None:
+    key = (anime_id, season_no, episode_no)
+    return await episode_cache.get_or_load(key, lambda: _load_episode(anime_id, season_no, episode_no))
+
+
+def _drop_episode(anime_id: int, season_no: int, episode_no: int):
+    episode_cache.pop((anime_id, season_no, episode_no))
+
+
+def _media(file_id: str, media_type: str, duration: int | None, file_size: int | None) -> tuple:
+    return file_id, media_type or media_type_of(file_id), duration, file_size
+
+
+async def add_or_replace_episode(anime_id: int, season_no: int, episode_no: int, file_id: str, caption: str = "",
+                                 media_type: str = "", duration: int | None = None, file_size: int | None = None):
+    async with writing() as conn:
+        await conn.execute(
+            "INSERT OR IGNORE INTO seasons(anime_id, season_no) VALUES (?, ?)",
+            (anime_id, season_no),
+        )
+        await conn.execute(
+            "INSERT INTO episodes(anime_id, season_no, episode_no, file_id, media_type, duration, file_size, caption) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(anime_id, season_no, episode_no) DO UPDATE SET "
+            "file_id = excluded.file_id, media_type = excluded.media_type, duration = excluded.duration, "
+            "file_size = excluded.file_size, caption = excluded.caption",
+            (anime_id, season_no, episode_no, *_media(file_id, media_type, duration, file_size), caption),
+        )
+        await _log_change(conn, anime_id)
+    season_cache.pop(anime_id)
+    page_cache.pop_prefix((anime_id, season_no))
+    # a new episode also changes the cached next_no of the one before it
+    episode_cache.pop_prefix((anime_id, season_no))
+    _touch(anime_id)
+
+
+async def add_episodes(anime_id: int, season_no: int, files: list[Media],
+                       caption_for: Callable[[int], str] | None = None) -> list[int]:
+    """Append episodes after the season's last one, numbered in one pass.
+
+    BEGIN IMMEDIATE takes SQLite's write lock before MAX(episode_no) is read,
+    so concurrent uploads (from other processes too) never get the same numbers.
+    """
+    if not files:
+        return []
+    async with writing() as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        await conn.execute(
+            "INSERT OR IGNORE INTO seasons(anime_id, season_no) VALUES (?, ?)",
+            (anime_id, season_no),
+        )
+        async with conn.execute(
+            "SELECT COALESCE(MAX(episode_no), 0) FROM episodes WHERE anime_id = ? AND season_no = ?",
+            (anime_id, season_no),
+        ) as cur:
+            last = (await cur.fetchone())[0]
+        numbers = list(range(last + 1, last + 1 + len(files)))
+        await conn.executemany(
+            "INSERT INTO episodes(anime_id, season_no, episode_no, file_id, media_type, duration, file_size, caption) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(anime_id, season_no, n, *_media(*m), caption_for(n) if caption_for else "")
+             for n, m in zip(numbers, files)],
+        )
+        await _log_change(conn, anime_id)
+    season_cache.pop(anime_id)
+    page_cache.pop_prefix((anime_id, season_no))
+    for n in (last, *numbers):
+        _drop_episode(anime_id, season_no, n)
+    _touch(anime_id)
+    return numbers
+
+
+async def update_episode_file(anime_id: int, season_no: int, episode_no: int, file_id: str,
+                              media_type: str = "", duration: int | None = None, file_size: int | None = None):
+    async with writing() as conn:
+        await conn.execute(
+            "UPDATE episodes SET file_id = ?, media_type = ?, duration = ?, file_size = ? "
+            "WHERE anime_id = ? AND season_no = ? AND episode_no = ?",
+            (*_media(file_id, media_type, duration, file_size), anime_id, season_no, episode_no),
+        )
+        await _log_change(conn, anime_id)
+    _drop_episode(anime_id, season_no, episode_no)
+
+
+async def update_episode_caption(anime_id: int, season_no: int, episode_no: int, caption: str):
+    async with writing() as conn:
+        await conn.execute(
+            "UPDATE episodes SET caption = ? WHERE anime_id = ? AND season_no = ? AND episode_no = ?",
+            (caption, anime_id, season_no, episode_no),
+        )
+        await _log_change(conn, anime_id)
+    _drop_episode(anime_id, season_no, episode_no)
+
+
+async def set_media_types(rows: list[tuple[int, int, int, str]]):
+    """[(anime_id, season_no, episode_no, media_type), ...] for rows stored without a type."""
+    if not rows:
+        return
+    async with writing() as conn:
+        await conn.executemany(
+            "UPDATE episodes SET media_type = ? WHERE anime_id = ? AND season_no = ? AND episode_no = ?",
+            [(t, a, s, e) for a, s, e, t in rows],
+        )
+        for anime_id in {r[0] for r in rows}:
+            await _log_change(conn, anime_id)
+    for a, s, e, _ in rows:
+        _drop_episode(a, s, e)
+
+
+async def episodes_without_media_type(after: tuple[int, int, int], limit: int = 500) -> list[tuple]:
+    """Keyset chunk of (anime_id, season_no, episode_no, file_id) with media_type = ''."""
+    rows = await _fetchall(
+        "SELECT anime_id, season_no, episode_no, file_id FROM episodes "
+        "WHERE media_type = '' AND (anime_id, season_no, episode_no) > (?, ?, ?) "
+        "ORDER BY anime_id, season_no, episode_no LIMIT ?",
+        (*after, limit),
+    )
+    return [tuple(r) for r in rows]
+
+
+# ---------- BULK IMPORT ----------
+async def import_chunk(anime: list[dict], seasons: list[tuple[int, int]],
+                       episodes: list[tuple[int, int, int, str, str, str]]) -> dict[int, int]:
+    """Upsert one chunk of a catalogue manifest in a single transaction.
+
+    `anime` dicts carry the ANIME_FIELDS (None or missing = keep the stored
+    value, "" for a new title), `id` and `lock_code` (None = keep,
+    "" = unlock); a negative id is a placeholder for a new title, and
+    seasons/episodes ((anime_id, season_no, episode_no, file_id, media_type,
+    caption)) may refer to it. Episodes replace existing ones with the same
+    number. Returns placeholder -> assigned id.
+    """
+    new_ids: dict[int, int] = {}
+    touched = set()
+    locks: dict[int, str] = {}
+    async with writing() as conn:
+        await conn.execute("BEGIN IMMEDIATE")
+        for a in anime:
+            given = tuple(a.get(f) for f in IMPORT_FIELDS)
+            values = tuple(v or "" for v in given)
+            if a["id"] < 0:
+                cur = await conn.execute(
+                    "INSERT INTO anime(title, year, country, language, genres, description) VALUES (?, ?, ?, ?, ?, ?)",
+                    values,
+                )
+                anime_id = new_ids[a["id"]] = cur.lastrowid
+            else:
+                anime_id = a["id"]
+                await conn.execute(
+                    "INSERT INTO anime(id, title, year, country, language, genres, description) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET "
+                    + ", ".join(f"{f} = COALESCE(?, {f})" for f in IMPORT_FIELDS),
+                    (anime_id, *values, *given),
+                )
+                if None in given:
+                    # fields the row left out keep their stored values
+                    async with conn.execute("SELECT * FROM anime WHERE id = ?", (anime_id,)) as cur:
+                        a = dict(await cur.fetchone(), lock_code=a.get("lock_code"))
+            if a.get("lock_code") is not None:
+                code = a["lock_code"]
+                await conn.execute("UPDATE anime SET is_locked = ?, lock_code = ? WHERE id = ?",
+                                   (1 if code else 0, code, anime_id))
+                locks[anime_id] = code
+            await conn.execute(
+                "INSERT OR REPLACE INTO anime_fts(rowid, title, genres, country, language, description) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (anime_id, *_search_row(a)),
+            )
+            await _index_title(conn, anime_id, a.get("title") or "")
+            await _index_facets(conn, anime_id, a)
+            touched.add(anime_id)
+
+        def real(anime_id: int) -> int:
+            return new_ids.get(anime_id, anime_id)
+
+        await conn.executemany(
+            "INSERT OR IGNORE INTO seasons(anime_id, season_no) VALUES (?, ?)",
+            [(real(a), s) for a, s in seasons],
+        )
+        await conn.executemany(
+            "INSERT INTO episodes(anime_id, season_no, episode_no, file_id, media_type, caption) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(anime_id, season_no, episode_no) DO UPDATE SET "
+            "file_id = excluded.file_id, media_type = excluded.media_type, caption = excluded.caption",
+            [(real(a), s, e, file_id, media_type or media_type_of(file_id), caption)
+             for a, s, e, file_id, media_type, caption in episodes],
+        )
+        touched.update(real(a) for a, _ in seasons)
+        await conn.executemany("INSERT INTO catalog_changes(anime_id) VALUES (?)", [(a,) for a in touched])
+    _forget_anime(touched)
+    for anime_id, code in locks.items():
+        _set_lock_code(anime_id, code)
+    if anime:
+        search_cache.clear()
+        facet_cache.clear()
+    return new_ids
+
+
+async def catalogue_page(after: int = 0, limit: int = 500) -> tuple[list[dict], list[tuple], list[tuple]]:
+    """Keyset page of anime with id > `after`, with their seasons and
+    episodes, ordered for a manifest export: (anime, seasons, episodes)."""
+    anime = [dict(r) for r in await _fetchall("SELECT * FROM anime WHERE id > ? ORDER BY id LIMIT ?", (after, limit))]
+    if not anime:
+        return [], [], []
+    span = (anime[0]["id"], anime[-1]["id"])
+    seasons = [tuple(r) for r in await _fetchall(
+        "SELECT anime_id, season_no, episode_count FROM seasons WHERE anime_id BETWEEN ? AND ? "
+        "ORDER BY anime_id, season_no", span,
+    )]
+    episodes = [tuple(r) for r in await _fetchall(
+        "SELECT anime_id, season_no, episode_no, file_id, media_type, caption FROM episodes "
+        "WHERE anime_id BETWEEN ? AND ? ORDER BY anime_id, season_no, episode_no", span,
+    )]
+    return anime, seasons, episodes
+
+
+# ---------- WATCH PROGRESS ----------
+async def save_progress(rows: list[tuple[tuple[int, int], tuple[int, int, int]]]):
+    """[((user_id, anime_id), (watched_at, season_no, episode_no)), ...] as
+    collected by a WriteBehind; an older entry never overwrites a newer one."""
+    if not rows:
+        return
+    async with writing() as conn:
+        await conn.executemany(
+            "INSERT INTO watch_progress(user_id, anime_id, season_no, episode_no, watched_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id, anime_id) DO UPDATE SET season_no = excluded.season_no, "
+            "episode_no = excluded.episode_no, watched_at = excluded.watched_at "
+            "WHERE excluded.watched_at >= watched_at",
+            [(u, a, s, e, ts) for (u, a), (ts, s, e) in rows],
+        )
+
+
+async def recent_progress(user_id: int, limit: int = 3) -> list[dict]:
+    """Most recently watched titles with the episode to continue from: the
+    one after the last watched, or the last watched if it was the final one."""
+    rows = await _fetchall(
+        "SELECT w.anime_id, a.title, w.season_no, w.episode_no, COALESCE(("
+        "  SELECT n.episode_no FROM episodes n"
+        "  WHERE n.anime_id = w.anime_id AND n.season_no = w.season_no AND n.episode_no > w.episode_no"
+        "  ORDER BY n.episode_no LIMIT 1"
+        "), w.episode_no) AS resume_no "
+        "FROM watch_progress w JOIN anime a ON a.id = w.anime_id "
+        "WHERE w.user_id = ? ORDER BY w.watched_at DESC LIMIT ?",
+        (user_id, limit),
+    )
+    return [dict(r) for r in rows]
+
+
+# ---------- FSM ----------
+async def get_fsm(key: str) -> tuple[str | None, str] | None:
+    row = await _fetchone("SELECT state, data FROM fsm WHERE key = ?", (key,))
+    return (row[0], row[1]) if row else None
+
+
+async def set_fsm_state(key: str, state: str | None):
+    async with writing() as conn:
+        await conn.execute(
+            "INSERT INTO fsm(key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (key, state),
+        )
+        await conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+
+async def set_fsm_data(key: str, data: str):
+    async with writing() as conn:
+        await conn.execute(
+            "INSERT INTO fsm(key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (key, data),
+        )
+        await conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+
+
+# ---------- STATS ----------
+def day_of(ts: int) -> int:
+    return ts // DAY
+
+
+async def add_title_events(rows: list[tuple[tuple[int, int], tuple[int, int]]]):
+    """[((day, anime_id), (views, opens)), ...] as collected by a WriteBehind."""
+    if not rows:
+        return
+    async with writing() as conn:
+        await conn.executemany(
+            "INSERT INTO daily_views(day, anime_id, views, opens) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(day, anime_id) DO UPDATE SET "
+            "views = views + excluded.views, opens = opens + excluded.opens",
+            [(day, anime_id, views, opens) for (day, anime_id), (views, opens) in rows],
+        )
+
+
+# ---------- RANKINGS ----------
+# board -> (days back, weight of the oldest day relative to today); an open
+# counts OPEN_WEIGHT deliveries
+BOARDS = {"trending": (2, 0.25), "week": (7, 1.0)}
+OPEN_WEIGHT = 3
+RANKING_SIZE = 50
+# board -> [(anime_id, title, score)], until the next refresh or ttl
+ranking_cache = TTLCache(maxsize=16, ttl=60)
+
+
+async def refresh_rankings(size: int = RANKING_SIZE):
+    """Rebuild every board from daily_views. Reads at most days x titles
+    bucket rows; menus then read the stored ranks only."""
+    today = day_of(int(time.time()))
+    async with writing() as conn:
+        for board, (days, oldest_weight) in BOARDS.items():
+            since = today - days + 1
+            # linear decay from 1 (today) to oldest_weight (first day)
+            step = (1 - oldest_weight) / max(1, days - 1)
+            await conn.execute("DELETE FROM rankings WHERE board = ?", (board,))
+            await conn.execute(
+                "INSERT INTO rankings(board, rank, anime_id, score) "
+                "SELECT ?, ROW_NUMBER() OVER (ORDER BY score DESC, anime_id), anime_id, score FROM ("
+                "  SELECT anime_id, SUM((views + ? * opens) * (1 - (? - day) * ?)) AS score"
+                "  FROM daily_views WHERE day >= ? GROUP BY anime_id"
+                ") WHERE score > 0 ORDER BY score DESC, anime_id LIMIT ?",
+                (board, OPEN_WEIGHT, today, step, since, size),
+            )
+    ranking_cache.clear()
+
+
+async def _load_ranking(board: str, limit: int) -> list[tuple[int, str, float]]:
+    rows = await _fetchall(
+        "SELECT r.anime_id, a.title, r.score FROM rankings r JOIN anime a ON a.id = r.anime_id "
+        "WHERE r.board = ? ORDER BY r.rank LIMIT ?",
+        (board, limit),
+    )
+    return [tuple(r) for r in rows]
+
+
+async def get_ranking(board: str, limit: int = 10) -> list[tuple[int, str, float]]:
+    return await ranking_cache.get_or_load((board, limit), lambda: _load_ranking(board, limit))
+
+
+async def stats(days: int = 7, top: int = 5) -> dict:
+    """Totals plus the last `days` days of activity; every read is a counter
+    row or a short primary-key range, whatever the size of the tables."""
+    today = day_of(int(time.time()))
+    since = today - days + 1
+    async with reading() as conn:
+        async with conn.execute("SELECT name, value FROM counters") as cur:
+            out = {name: value for name, value in await cur.fetchall()}
+        async with conn.execute(
+            "SELECT day, active, new_users FROM daily_activity WHERE day >= ? ORDER BY day", (since,)
+        ) as cur:
+            activity = {day: (active, new) for day, active, new in await cur.fetchall()}
+        async with conn.execute(
+            "SELECT day, SUM(views) FROM daily_views WHERE day >= ? GROUP BY day", (since,)
+        ) as cur:
+            views = dict(await cur.fetchall())
+        async with conn.execute(
+            "SELECT v.anime_id, COALESCE(a.title, '?'), SUM(v.views) AS n FROM daily_views v "
+            "LEFT JOIN anime a ON a.id = v.anime_id WHERE v.day >= ? "
+            "GROUP BY v.anime_id ORDER BY n DESC LIMIT ?",
+            (since, top),
+        ) as cur:
+            out["top"] = [tuple(r) for r in await cur.fetchall()]
+    # oldest first, missing days as zeros
+    out["daily"] = [
+        (day, *activity.get(day, (0, 0)), views.get(day, 0)) for day in range(since, today + 1)
+    ]
+    return out
@@ -0,0 +1,82 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Union, get_args, get_origin
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message, MessageId, User
+
+
+class FakeSession(BaseSession):
+    """In-process stand-in for the Bot API, for load tests and local runs.
+
+    Answers every method with a plausible result without touching the
+    network and counts calls per method. Chats in `blocked` / `deactivated`
+    fail like real users who blocked the bot or deleted their account, and
+    with `flood_every=N` every Nth send gets a retry_after.
+    """
+
+    def __init__(self, latency: float = 0.0, blocked=(), deactivated=(), missing=(),
+                 flood_every: int = 0, retry_after: int = 1, username: str = "fake_bot"):
+        super().__init__()
+        self.latency = latency
+        self.blocked = set(blocked)
+        self.deactivated = set(deactivated)
+        self.missing = set(missing)
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.username = username
+        self.calls: Counter = Counter()
+        self.sent_to: Counter = Counter()
+        self._ids = itertools.count(1)
+        self._sends = 0
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        name = type(method).__name__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            if chat_id in self.blocked:
+                raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+            if chat_id in self.deactivated:
+                raise TelegramForbiddenError(method=method, message="Forbidden: user is deactivated")
+            if chat_id in self.missing:
+                raise TelegramBadRequest(method=method, message="Bad Request: chat not found")
+            self._sends += 1
+            if self.flood_every and self._sends % self.flood_every == 0:
+                raise TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=self.retry_after)
+            self.sent_to[chat_id] += 1
+        return self._result(bot, method, chat_id)
+
+    def _result(self, bot: Bot, method: TelegramMethod, chat_id):
+        ret = method.__returning__
+        if ret is bool or (get_origin(ret) is Union and bool in get_args(ret)):
+            return True
+        if ret is Message:
+            return Message.model_validate(
+                {"message_id": next(self._ids), "date": int(time.time()),
+                 "chat": {"id": chat_id or 0, "type": "private" if (chat_id or 0) > 0 else "supergroup"}},
+                context={"bot": bot},
+            )
+        if ret is MessageId:
+            return MessageId(message_id=next(self._ids))
+        if ret is User:
+            return User(id=bot.id, is_bot=True, first_name="Fake", username=self.username)
+        if ret is Chat:
+            return Chat(id=chat_id or 0, type="private")
+        if get_origin(ret) is list:
+            return []
+        return True
@@ -0,0 +1,40 @@
+import base64
+import struct
+
+# Telegram file_id layout: urlsafe base64 of a zero-run-length-encoded blob
+# whose first int32 is the file type (plus flag bits)
+_WEB_LOCATION_FLAG = 1 << 24
+_FILE_REFERENCE_FLAG = 1 << 25
+
+# only types sendVideo / sendDocument take as they are; anything else (audio,
+# animation, video note, ...) stays '' and send_episode learns it on first use
+_TYPES = {
+    4: "video",
+    5: "document",
+    17: "document",   # document sent as file
+}
+
+
+def _rle_decode(data: bytes) -> bytes:
+    out = bytearray()
+    zero = False
+    for b in data:
+        if zero:
+            out.extend(b"\x00" * b)
+            zero = False
+        elif b == 0:
+            zero = True
+        else:
+            out.append(b)
+    return bytes(out)
+
+
+def media_type_of(file_id: str) -> str:
+    """'video', 'document' or '' when the file_id can't be classified."""
+    try:
+        raw = _rle_decode(base64.urlsafe_b64decode(file_id + "=" * (-len(file_id) % 4)))
+        file_type = struct.unpack("<i", raw[:4])[0]
+    except Exception:
+        return ""
+    file_type &= ~(_WEB_LOCATION_FLAG | _FILE_REFERENCE_FLAG)
+    return _TYPES.get(file_type, "")
@@ -0,0 +1,56 @@
+import json
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import db
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in the bot's own database, shared by every worker process."""
+
+    def __init__(self, key_builder: KeyBuilder | None = None):
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await db.set_fsm_state(self.key_builder.build(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = await db.get_fsm(self.key_builder.build(key))
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await db.set_fsm_data(self.key_builder.build(key), json.dumps(data, ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = await db.get_fsm(self.key_builder.build(key))
+        return json.loads(row[1]) if row else {}
+
+    async def close(self) -> None:
+        pass
+
+
+def make_storage(url: str = "sqlite", redis_client=None) -> BaseStorage:
+    """FSM_STORAGE: `sqlite` (default), `memory` or a `redis://` URL.
+
+    `redis_client` overrides the connection built from the URL, e.g. with a
+    local stand-in such as fakeredis.
+    """
+    url = (url or "sqlite").strip()
+    if url == "memory":
+        return MemoryStorage()
+    if url == "sqlite":
+        return SQLiteStorage()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as e:
+            raise RuntimeError("Redis FSM uchun `pip install redis` kerak.") from e
+        key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        if redis_client is not None:
+            return RedisStorage(redis_client, key_builder=key_builder)
+        return RedisStorage.from_url(url, key_builder=key_builder)
+    raise ValueError(f"unknown FSM_STORAGE: {url}")
@@ -0,0 +1,292 @@
+"""Bulk catalogue import from a JSONL or CSV manifest.
+
+    python importer.py catalogue.jsonl
+
+One record per line (JSONL) or per row (CSV with a header). Fields, all
+optional per row:
+
+    anime_id, title, year, country, language, genres, description, lock_code,
+    season_no, episode_no, file_id, media_type, caption
+
+A row with a title creates or updates that anime (at `anime_id` if given,
+so existing ids and deep links survive a migration); fields it leaves out
+or empty keep their stored values. A row with episode_no
+and file_id adds or replaces that episode (season_no defaults to 1); one
+with only season_no creates the season. Rows without anime_id belong to
+the last titled row above them. lock_code: three digits to lock, "-" to
+unlock, empty to leave as is.
+
+The file is read row by row and written in chunks of CHUNK rows, one
+transaction each; bad rows are skipped and reported with their line number.
+"""
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Iterator
+
+import db
+
+log = logging.getLogger(__name__)
+
+CHUNK = 2000
+PROGRESS_EVERY = 3.0
+MAX_ERRORS = 5000  # kept for the report; the rest are only counted
+
+TEXT_FIELDS = ("title", "year", "country", "language", "genres", "description")
+MEDIA_TYPES = ("", "video", "document")
+
+
+# ---------- READING ----------
+def _is_csv(path: str) -> bool:
+    if path.lower().endswith(".csv"):
+        return True
+    if path.lower().endswith((".jsonl", ".ndjson", ".json")):
+        return False
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            if line.strip():
+                return not line.lstrip().startswith("{")
+    return False
+
+
+def read_manifest(path: str) -> Iterator[tuple[int, dict | str]]:
+    """(line number, row) per record; a str instead of a row is a parse error."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if _is_csv(path):
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, {k.strip().lower(): v for k, v in row.items() if k}
+            return
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, f"JSON xato: {e.msg}"
+                continue
+            yield line_no, row if isinstance(row, dict) else "obyekt kutilgan"
+
+
+def _text(row: dict, field: str) -> str:
+    value = row.get(field)
+    if value is None:
+        return ""
+    return str(value).strip() if field == "description" else " ".join(str(value).split())
+
+
+def _int(row: dict, field: str) -> int | None:
+    """None if empty; raises ValueError on anything but a positive integer."""
+    value = row.get(field)
+    if value is None or str(value).strip() == "":
+        return None
+    n = int(str(value).strip())
+    if n < 1:
+        raise ValueError
+    return n
+
+
+# ---------- IMPORT ----------
+class _ChunkFailed(Exception):
+    pass
+
+
+class ManifestImport:
+    """One manifest import. Counters are readable while it runs."""
+
+    def __init__(self, path: str, progress: Callable[["ManifestImport"], Awaitable[None]] | None = None):
+        self.path = path
+        self.progress = progress
+        self.rows = self.anime = self.seasons = self.episodes = 0
+        self.error_count = 0
+        self.errors: list[tuple[int, str]] = []
+        self.failed: str | None = None  # set when a chunk could not be written
+        self.elapsed = 0.0
+
+        self._current: int | None = None  # anime id rows without anime_id belong to
+        self._current_title = ""
+        self._next_placeholder = -1
+        self._known: set[int] = set()
+        self._missing: set[int] = set()
+        self._written: dict[int, tuple] = {}  # anime id -> fields last written
+        self._claimed: dict[str, int] = {}  # lock code -> anime id, this file
+        self._anime: dict[int, dict] = {}
+        self._season_keys: set[tuple[int, int]] = set()
+        self._episodes: dict[tuple[int, int, int], tuple] = {}
+        self._pending = 0
+        self._first_line = 0
+
+    def _error(self, line_no: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line_no, message))
+
+    async def _exists(self, anime_id: int) -> bool:
+        if anime_id in self._known:
+            return True
+        if anime_id in self._missing:
+            return False
+        if await db.get_anime(anime_id):
+            self._known.add(anime_id)
+            return True
+        self._missing.add(anime_id)
+        return False
+
+    async def _row(self, line_no: int, row: dict) -> str | None:
+        """Queue one row for the current chunk; returns an error message instead."""
+        try:
+            anime_id = _int(row, "anime_id")
+            season_no = _int(row, "season_no")
+            episode_no = _int(row, "episode_no")
+        except ValueError:
+            return "anime_id, season_no va episode_no musbat butun son bo‘lishi kerak"
+        title = _text(row, "title")
+        file_id = _text(row, "file_id")
+        media_type = _text(row, "media_type").lower()
+        code = _text(row, "lock_code")
+        if episode_no is not None and not file_id:
+            return "episode_no bor, file_id yo‘q"
+        if file_id and episode_no is None:
+            return "file_id bor, episode_no yo‘q"
+        if media_type not in MEDIA_TYPES:
+            return f"media_type noma’lum: {media_type}"
+        if code and code != "-" and not (len(code) == 3 and code.isdigit()):
+            return "lock_code 3 xonali raqam yoki '-' bo‘lishi kerak"
+        if code and not title:
+            return "lock_code faqat nomli qatorda"
+
+        if title:
+            if anime_id is None:
+                if title == self._current_title and self._current is not None:
+                    anime_id = self._current  # denormalised rows repeating the title
+                else:
+                    anime_id = self._next_placeholder
+                    self._next_placeholder -= 1
+            if code and code != "-" and {self._claimed.get(code), db.anime_id_by_code(code)} - {None, anime_id}:
+                return f"lock_code {code} boshqa animega band"
+            # empty = keep the stored value, like lock_code
+            a = {f: _text(row, f) or None for f in TEXT_FIELDS}
+            a["lock_code"] = "" if code == "-" else code or None
+            fields = tuple(a.values())
+            if self._written.get(anime_id) != fields:
+                self._written[anime_id] = fields
+                queued = self._anime.get(anime_id, {})
+                self._anime[anime_id] = dict(queued, **{k: v for k, v in a.items() if v is not None}, id=anime_id)
+                if code and code != "-":
+                    self._claimed[code] = anime_id
+            self._known.add(anime_id)
+            self._current, self._current_title = anime_id, title
+        elif anime_id is None:
+            if self._current is None:
+                return "anime_id yo‘q va undan oldin nomli qator yo‘q"
+            anime_id = self._current
+        elif not await self._exists(anime_id):
+            return f"anime_id {anime_id} topilmadi (nomi bilan qo‘shing)"
+
+        if episode_no is not None or season_no is not None:
+            season_no = season_no or 1
+            self._season_keys.add((anime_id, season_no))
+            if episode_no is not None:
+                self._episodes[(anime_id, season_no, episode_no)] = (
+                    anime_id, season_no, episode_no, file_id, media_type, _text(row, "caption"),
+                )
+        return None
+
+    async def _flush(self, last_line: int):
+        if not self._pending:
+            return
+        anime, seasons, episodes = list(self._anime.values()), list(self._season_keys), list(self._episodes.values())
+        try:
+            new_ids = await db.import_chunk(anime, seasons, episodes)
+        except Exception as e:
+            log.exception("import %s: chunk %s-%s failed", self.path, self._first_line, last_line)
+            raise _ChunkFailed(f"{self._first_line}–{last_line}-qatorlar yozilmadi: {e}") from e
+        for placeholder, real in new_ids.items():
+            self._known.add(real)
+            self._written[real] = self._written.pop(placeholder, ())
+            for code, owner in list(self._claimed.items()):
+                if owner == placeholder:
+                    self._claimed[code] = real
+        if self._current in new_ids:
+            self._current = new_ids[self._current]
+        self.anime += len(anime)
+        self.seasons += len(seasons)
+        self.episodes += len(episodes)
+        self._anime, self._season_keys, self._episodes = {}, set(), {}
+        self._pending = 0
+
+    async def run(self) -> "ManifestImport":
+        start = time.perf_counter()
+        reported = time.monotonic()
+        line_no = 0
+        try:
+            for line_no, row in read_manifest(self.path):
+                self.rows += 1
+                error = row if isinstance(row, str) else await self._row(line_no, row)
+                if error:
+                    self._error(line_no, error)
+                    if isinstance(row, str) or row.get("title"):
+                        # the rows below may belong to this title: don't file them under the previous one
+                        self._current, self._current_title = None, ""
+                    continue
+                if not self._pending:
+                    self._first_line = line_no
+                self._pending += 1
+                if self._pending >= CHUNK:
+                    await self._flush(line_no)
+                    if self.progress and time.monotonic() - reported >= PROGRESS_EVERY:
+                        reported = time.monotonic()
+                        await self.progress(self)
+            await self._flush(line_no)
+        except _ChunkFailed as e:
+            self.failed = str(e)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            self.failed = f"faylni o‘qib bo‘lmadi ({line_no}-qator): {e}"
+        self.elapsed = time.perf_counter() - start
+        return self
+
+    # ---------- report ----------
+    def summary(self, done: bool = False) -> str:
+        head = ("⚠️ To‘xtadi" if self.failed else "✅ Tugadi") if done else "⏳ Import"
+        lines = [
+            f"📥 {head}",
+            f"📄 Qatorlar: {self.rows}",
+            f"🎬 Anime: {self.anime}",
+            f"📺 Fasl: {self.seasons}",
+            f"🎞 Qism: {self.episodes}",
+            f"❌ Xato qatorlar: {self.error_count}",
+        ]
+        if done:
+            lines.append(f"⏱ {self.elapsed:.1f}s ({self.rows / max(self.elapsed, 1e-9) * 60:,.0f} qator/min)")
+        if self.failed:
+            lines.append(self.failed)
+        return "\n".join(lines)
+
+    def error_report(self) -> str:
+        out = [f"{line_no}: {message}" for line_no, message in self.errors]
+        if self.error_count > len(self.errors):
+            out.append(f"... va yana {self.error_count - len(self.errors)} ta")
+        return "\n".join(out) + "\n"
+
+
+async def _run(path: str):
+    logging.basicConfig(level=logging.INFO)
+    await db.init_db()
+    try:
+        imp = await ManifestImport(path).run()
+        print(imp.summary(done=True))
+        if imp.errors:
+            print(imp.error_report(), end="")
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2 or not os.path.isfile(sys.argv[1]):
+        sys.exit(__doc__.split("\n\n")[1])
+    asyncio.run(_run(sys.argv[1]))
@@ -1,18 +1,22 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from callbacks import (Admin, AddSeason, Back, BrowseFacet, BrowseHome, BrowseValue, EditEpisodes, Episode, Jump,
+                       Noop, OpenAnime, Page, Season, Top)
+
 def seasons_kb(anime_id: int, seasons: list[int], is_admin: bool=False) -> InlineKeyboardMarkup:
     rows = []
     for s in seasons:
-        rows.append([InlineKeyboardButton(text=f"{s}-FASL", callback_data=f"s:{anime_id}:{s}")])
+        rows.append([InlineKeyboardButton(text=f"{s}-FASL", callback_data=Season(anime_id=anime_id, season_no=s).pack())])
     if is_admin:
-        rows.append([InlineKeyboardButton(text="➕ Fasl qo‘shish", callback_data=f"admin:add_season:{anime_id}")])
+        rows.append([InlineKeyboardButton(text="➕ Fasl qo‘shish", callback_data=AddSeason(anime_id=anime_id).pack())])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def episodes_kb(anime_id: int, season_no: int, eps: list[int], page: int, has_prev: bool, has_next: bool, is_admin: bool=False) -> InlineKeyboardMarkup:
+def episodes_kb(anime_id: int, season_no: int, eps: list[int], prev_start: int | None, next_start: int | None,
+                is_admin: bool=False) -> InlineKeyboardMarkup:
     rows = []
     row = []
     for i, ep in enumerate(eps, 1):
-        row.append(InlineKeyboardButton(text=str(ep), callback_data=f"e:{anime_id}:{season_no}:{ep}"))
+        row.append(InlineKeyboardButton(text=str(ep), callback_data=Episode(anime_id=anime_id, season_no=season_no, episode_no=ep).pack()))
         if i % 5 == 0:
             rows.append(row)
             row = []
@@ -20,25 +24,125 @@ def episodes_kb(anime_id: int, season_no: int, eps: list[int], page: int, has_pr
         rows.append(row)
 
     nav = []
-    if has_prev:
-        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"p:{anime_id}:{season_no}:{page-1}"))
-    nav.append(InlineKeyboardButton(text=f"{page+1}", callback_data="noop"))
-    if has_next:
-        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"p:{anime_id}:{season_no}:{page+1}"))
-    rows.append(nav)
+    if prev_start is not None:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=Page(anime_id=anime_id, season_no=season_no, start=prev_start).pack()))
+    if eps:
+        # the middle button opens the range chooser for long seasons
+        paged = prev_start is not None or next_start is not None
+        jump = Jump(anime_id=anime_id, season_no=season_no) if paged else Noop()
+        nav.append(InlineKeyboardButton(text=f"{eps[0]}–{eps[-1]}", callback_data=jump.pack()))
+    if next_start is not None:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=Page(anime_id=anime_id, season_no=season_no, start=next_start).pack()))
+    if nav:
+        rows.append(nav)
 
     if is_admin:
-        rows.append([InlineKeyboardButton(text="✏️ Epizodni tahrirlash", callback_data=f"admin:edit_ep:{anime_id}:{season_no}")])
+        rows.append([InlineKeyboardButton(text="✏️ Epizodni tahrirlash", callback_data=EditEpisodes(anime_id=anime_id, season_no=season_no).pack())])
+
+    rows.append([InlineKeyboardButton(text="⬅️ Fasllar", callback_data=Back(anime_id=anime_id).pack())])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def ranges_kb(anime_id: int, season_no: int, ranges: list[tuple[int, int]]) -> InlineKeyboardMarkup:
+    rows = []
+    row = []
+    for i, (first, last) in enumerate(ranges, 1):
+        row.append(InlineKeyboardButton(text=f"{first}–{last}", callback_data=Page(anime_id=anime_id, season_no=season_no, start=first).pack()))
+        if i % 4 == 0:
+            rows.append(row)
+            row = []
+    if row:
+        rows.append(row)
+    rows.append([InlineKeyboardButton(text="⬅️ Qismlar", callback_data=Season(anime_id=anime_id, season_no=season_no).pack())])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def next_episode_kb(anime_id: int, season_no: int, next_no: int | None) -> InlineKeyboardMarkup:
+    row = []
+    if next_no is not None:
+        row.append(InlineKeyboardButton(text=f"Keyingi qism ▶️ {next_no}",
+                                        callback_data=Episode(anime_id=anime_id, season_no=season_no, episode_no=next_no).pack()))
+    row.append(InlineKeyboardButton(text="📺 Qismlar", callback_data=Season(anime_id=anime_id, season_no=season_no).pack()))
+    return InlineKeyboardMarkup(inline_keyboard=[row])
+
+def continue_kb(items: list[dict]) -> InlineKeyboardMarkup:
+    rows = []
+    for it in items:
+        rows.append([InlineKeyboardButton(
+            text=f"▶️ {it['title'][:40]} • {it['season_no']}-fasl {it['resume_no']}-qism",
+            callback_data=Episode(anime_id=it["anime_id"], season_no=it["season_no"], episode_no=it["resume_no"]).pack(),
+        )])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def watch_link_kb(url: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="▶️ Botda ko‘rish", url=url)]])
+
+FACET_NAMES = {"genre": "🎭 Janr", "year": "📅 Yil", "country": "🌍 Davlat", "language": "🗣 Til"}
+
+def facets_kb(within: int = 0) -> InlineKeyboardMarkup:
+    buttons = [InlineKeyboardButton(text=name, callback_data=BrowseFacet(facet=facet, within=within, offset=0).pack())
+               for facet, name in FACET_NAMES.items()]
+    rows = [buttons[:2], buttons[2:]]
+    if within:
+        rows.append([InlineKeyboardButton(text="⬅️ Natijalar", callback_data=BrowseValue(value_id=within, within=0, after=0).pack())])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def facet_values_kb(facet: str, within: int, values: list[tuple[int, str, int]], offset: int, page_size: int,
+                    has_more: bool) -> InlineKeyboardMarkup:
+    rows = []
+    row = []
+    for i, (value_id, label, count) in enumerate(values, 1):
+        row.append(InlineKeyboardButton(text=f"{label[:24]} ({count})",
+                                        callback_data=BrowseValue(value_id=value_id, within=within, after=0).pack()))
+        if i % 2 == 0:
+            rows.append(row)
+            row = []
+    if row:
+        rows.append(row)
+
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=BrowseFacet(facet=facet, within=within, offset=max(0, offset - page_size)).pack()))
+    if has_more:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=BrowseFacet(facet=facet, within=within, offset=offset + page_size).pack()))
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text="⬅️ Bo‘limlar", callback_data=BrowseHome(within=within).pack())])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def browse_results_kb(value_id: int, within: int, items: list[tuple[int, str]], next_after: int | None) -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton(text=title[:60], callback_data=OpenAnime(anime_id=anime_id).pack())]
+            for anime_id, title in items]
+    if next_after is not None:
+        rows.append([InlineKeyboardButton(text="➡️ Yana",
+                                          callback_data=BrowseValue(value_id=value_id, within=within, after=next_after).pack())])
+    if not within:
+        rows.append([InlineKeyboardButton(text="➕ Yana filtr", callback_data=BrowseHome(within=value_id).pack())])
+    rows.append([InlineKeyboardButton(text="⬅️ Bo‘limlar", callback_data=BrowseHome(within=0).pack())])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+BOARD_NAMES = {"trending": "🔥 Trendda", "week": "🏆 Hafta topi"}
+
+def boards_kb(current: str | None = None) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=("• " if board == current else "") + name, callback_data=Top(board=board).pack())
+        for board, name in BOARD_NAMES.items()
+    ]])
 
-    rows.append([InlineKeyboardButton(text="⬅️ Fasllar", callback_data=f"back:{anime_id}")])
+def ranking_kb(board: str, items: list[tuple[int, str, float]]) -> InlineKeyboardMarkup:
+    rows = [[InlineKeyboardButton(text=f"{i}. {title[:50]}", callback_data=OpenAnime(anime_id=anime_id).pack())]
+            for i, (anime_id, title, _) in enumerate(items, 1)]
+    rows += boards_kb(board).inline_keyboard
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 def admin_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="➕ Anime qo‘shish", callback_data="admin:add_anime")],
-        [InlineKeyboardButton(text="🎞 Qism qo‘shish (tez)", callback_data="admin:add_ep")],
-        [InlineKeyboardButton(text="✏️ Anime tahrirlash", callback_data="admin:edit_anime")],
-        [InlineKeyboardButton(text="🔐 Kod bilan yopish", callback_data="admin:lock")],
-        [InlineKeyboardButton(text="📢 Post shabloni", callback_data="admin:post")],
-        [InlineKeyboardButton(text="📊 Statistika", callback_data="admin:stats")]
+        [InlineKeyboardButton(text="➕ Anime qo‘shish", callback_data=Admin(action="add_anime").pack())],
+        [InlineKeyboardButton(text="🎞 Qism qo‘shish (tez)", callback_data=Admin(action="add_ep").pack())],
+        [InlineKeyboardButton(text="✏️ Anime tahrirlash", callback_data=Admin(action="edit_anime").pack())],
+        [InlineKeyboardButton(text="🔐 Kod bilan yopish", callback_data=Admin(action="lock").pack())],
+        [InlineKeyboardButton(text="📢 Post shabloni", callback_data=Admin(action="post").pack())],
+        [InlineKeyboardButton(text="📣 Xabar tarqatish", callback_data=Admin(action="broadcast").pack())],
+        [InlineKeyboardButton(text="📥 Manifest import", callback_data=Admin(action="import").pack())],
+        [InlineKeyboardButton(text="💾 Zaxira nusxa", callback_data=Admin(action="backup").pack()),
+         InlineKeyboardButton(text="📤 Katalog eksporti", callback_data=Admin(action="export").pack())],
+        [InlineKeyboardButton(text="📊 Statistika", callback_data=Admin(action="stats").pack())]
     ])
\ No newline at end of file
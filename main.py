@@ -1,20 +1,41 @@
 import os
+import re
 import time
 import asyncio
 import logging
+import math
+import tempfile
 
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
-from aiogram.filters import CommandStart, Command
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import CommandStart, Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, CallbackQuery, LinkPreviewOptions
+from aiogram.types import BufferedInputFile, FSInputFile, Message, CallbackQuery, InlineQuery, LinkPreviewOptions
 
+import backup
+import broadcast
 import db
-from keyboards import seasons_kb, episodes_kb, admin_menu
+import importer
+import metrics
+import render
+from batching import Debounce, WriteBehind
+from botinfo import BotIdentity
+from cache import TTLCache
+from ratelimit import OutboundLimiter
+from throttle import DoubleTapGuard, SlidingWindowLimiter, split_limits
+import webhook
+import workers
+from fsm_storage import make_storage
+from keyboards import (BOARD_NAMES, FACET_NAMES, admin_menu, browse_results_kb, continue_kb, facet_values_kb,
+                       facets_kb, next_episode_kb, ranking_kb)
+import callbacks as cb
 
 
 # ---------- PATHS ----------
@@ -30,13 +51,73 @@ ADMIN_ID = int((os.getenv("ADMIN_ID", "0") or "0").strip() or "0")
 if not BOT_TOKEN or ADMIN_ID == 0:
     raise RuntimeError("BOT_TOKEN yoki ADMIN_ID yo‘q. .env faylga qo‘ying.")
 
+# e.g. a local Bot API server or a fake one for load tests
+BOT_API_URL = os.getenv("BOT_API_URL", "").strip()
+
+# polling | webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").strip().lower()
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080").strip() or "8080")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook").strip()
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()
+WEBHOOK_REPLY = os.getenv("WEBHOOK_REPLY", "1").strip() == "1"
+
+# >1: one polling supervisor + N worker processes sharded by chat id
+WORKERS = int(os.getenv("WORKERS", "1").strip() or "1")
+# 0 on all but one instance when several webhook instances share the database:
+# only the primary runs the rankings, backup and broadcast-resume loops
+PRIMARY = os.getenv("PRIMARY", "1").strip() != "0"
+# sqlite | memory | redis://...; unset: memory for a single polling process
+# (no SQLite read per update), sqlite when several processes share FSM state
+FSM_STORAGE = os.getenv("FSM_STORAGE", "").strip() or (
+    "sqlite" if WORKERS > 1 or BOT_MODE == "webhook" else "memory"
+)
+
 bot = Bot(
     token=BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None,
     default=DefaultBotProperties(parse_mode=ParseMode.HTML),
 )
-dp = Dispatcher()
-
-PAGE_SIZE = 30
+# per-chat + global token buckets and flood-wait retries for everything we send;
+# the buckets are per process, so all processes sending for this bot split
+# Telegram's ~30 msg/s between them: WORKERS in polling mode, SEND_PROCESSES
+# (the instance count) for several webhook instances
+SEND_PROCESSES = int(os.getenv("SEND_PROCESSES", "").strip() or (WORKERS if BOT_MODE == "polling" else 1))
+limiter = OutboundLimiter(global_rate=30 / max(SEND_PROCESSES, 1))
+bot.session.middleware(limiter)
+dp = Dispatcher(storage=make_storage(FSM_STORAGE))
+
+PRERENDER_ON_ADD = os.getenv("PRERENDER_ON_ADD", "1").strip() == "1"
+# a season is prerendered once no upload to it has arrived for this long:
+# every upload bumps anime_version, which would discard a render in flight
+PRERENDER_DELAY = 5.0
+
+# /metrics on METRICS_HOST:METRICS_PORT (+ worker index); 0 = off
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1").strip()
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0").strip() or "0")
+# log the db/API trace of updates slower than this many ms; 0 = off
+SLOW_UPDATE_MS = float(os.getenv("SLOW_UPDATE_MS", "0").strip() or "0")
+# repeated taps on one button within this many ms are answered and dropped; 0 = off
+DOUBLE_TAP_MS = float(os.getenv("DOUBLE_TAP_MS", "1500").strip() or "0")
+double_taps = DoubleTapGuard(window=DOUBLE_TAP_MS / 1000)
+if DOUBLE_TAP_MS:
+    dp.callback_query.outer_middleware(double_taps)
+
+if METRICS_PORT or SLOW_UPDATE_MS:
+    metrics.instrument_db(db)
+    dp.update.outer_middleware(metrics.UpdateMetrics(slow_ms=SLOW_UPDATE_MS, router=dp, callback_key=cb.router.key_of))
+    # inside the limiter: measures Telegram, not our own queueing
+    bot.session.middleware(metrics.ApiMetrics())
+    metrics.gauge("bot_outbound_queue", "Outbound limiter state", limiter.snapshot)
+    metrics.gauge("bot_cache_hit_ratio", "Hit ratio of the db caches", lambda: {
+        name: round(c.hits / max(1, c.hits + c.misses), 4)
+        for name, c in (("anime", db.anime_cache), ("season", db.season_cache),
+                        ("page", db.page_cache), ("episode", db.episode_cache))
+    })
+    metrics.gauge("bot_deduplicated", "Repeated taps dropped and renders shared with one in flight", lambda: {
+        "double_tap": double_taps.dropped, "render": render.shared_builds(),
+    })
 LPO_OFF = LinkPreviewOptions(is_disabled=True)
 
 
@@ -44,6 +125,32 @@ def is_admin(user_id: int) -> bool:
     return user_id == ADMIN_ID
 
 
+identity = BotIdentity()
+
+# /start upserts are coalesced per user and written in one transaction
+user_activity = WriteBehind(db.upsert_users, interval=0.5, max_rows=500, merge=max, name="user-activity")
+# last episode per (user, anime); the newest watched_at wins
+watch_progress = WriteBehind(db.save_progress, interval=2.0, max_rows=1000, merge=max, name="watch-progress")
+# 3-digit codes are only 1000 values: cap guesses per user. Counted in memory,
+# so a flood never reaches the database; several webhook instances each get
+# their share (a polling worker already sees all of a chat's guesses)
+CODE_ATTEMPT_LIMITS = ((5, 60), (20, 3600))
+code_attempts = SlidingWindowLimiter(
+    split_limits(CODE_ATTEMPT_LIMITS, SEND_PROCESSES if BOT_MODE == "webhook" else 1)
+)
+# (episode deliveries, deep-link opens) summed per (day, anime), added to daily_views in batches
+title_events = WriteBehind(db.add_title_events, interval=5.0, max_rows=1000,
+                           merge=lambda a, b: (a[0] + b[0], a[1] + b[1]), name="title-events")
+# (day, user, anime) whose deep-link open is already counted: repeated taps
+# don't push a title up /top (a chat always lands on the same worker)
+counted_opens = TTLCache(maxsize=100_000, ttl=86400)
+RANKINGS_INTERVAL = int(os.getenv("RANKINGS_INTERVAL", "300").strip() or "300")
+# scheduled online backups (primary process only); 0 = admin-triggered only
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups").strip() or "backups"
+BACKUP_EVERY_HOURS = float(os.getenv("BACKUP_EVERY_HOURS", "24").strip() or "0")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7").strip() or "7")
+
+
 # ---------- STATES ----------
 class AddAnime(StatesGroup):
     title = State()
@@ -57,7 +164,7 @@ class AddAnime(StatesGroup):
 class AddEpisode(StatesGroup):
     anime_id = State()
     season_no = State()
-    mode = State()  # auto/manual
+    mode = State()  # auto/manual/bulk
     episode_no = State()
     waiting_video = State()
 
@@ -93,89 +200,100 @@ class PostTemplate(StatesGroup):
     season_no = State()
 
 
+class BroadcastFlow(StatesGroup):
+    content = State()
+    segment = State()
+
+
+class ImportFlow(StatesGroup):
+    manifest = State()
+
+
 # ---------- HELPERS ----------
-async def show_anime(target: Message | CallbackQuery, anime_id: int):
-    a = await db.get_anime(anime_id)
-    if not a:
-        txt = "Bunday ID topilmadi."
-        if isinstance(target, Message):
-            return await target.answer(txt)
-        return await target.message.answer(txt)
+def media_of(msg: Message) -> db.Media | None:
+    if msg.video:
+        return db.Media(msg.video.file_id, "video", msg.video.duration, msg.video.file_size)
+    if msg.document:
+        return db.Media(msg.document.file_id, "document", None, msg.document.file_size)
+    return None
+
+
+_bg_tasks: set[asyncio.Task] = set()
+_metrics_runner = None
+
+
+def spawn(coro) -> asyncio.Task:
+    # keep a reference so fire-and-forget tasks are not garbage collected
+    task = asyncio.create_task(coro)
+    _bg_tasks.add(task)
+    task.add_done_callback(_bg_tasks.discard)
+    return task
+
 
-    if a.get("is_locked", 0) == 1 and not is_admin(target.from_user.id):
-        txt = "🔒 Bu kontent kod bilan yopilgan. 3 xonali kodni yuboring."
+async def can_view(user_id: int, a: dict) -> bool:
+    if a.get("is_locked", 0) != 1 or is_admin(user_id):
+        return True
+    # an unlock only counts while the title keeps the code it was opened with
+    return await db.has_unlocked(user_id, a["id"], a["lock_code"])
+
+
+async def show_anime(target: Message | CallbackQuery, anime_id: int) -> bool:
+    """Send the anime card; False if the title is missing or locked for this user."""
+    a = await db.get_anime(anime_id)
+    if not a or not await can_view(target.from_user.id, a):
+        txt = "Bunday ID topilmadi." if not a else render.LOCKED_TEXT
         if isinstance(target, Message):
-            return await target.answer(txt)
-        return await target.message.answer(txt)
-
-    seasons = await db.list_seasons(anime_id)
-
-    meta = []
-    if a.get("year"):
-        meta.append(f"📅 Yili: {a['year']}")
-    if a.get("country"):
-        meta.append(f"🌍 Davlati: {a['country']}")
-    if a.get("language"):
-        meta.append(f"🗣 Tili: {a['language']}")
-    if a.get("genres"):
-        meta.append(f"🎭 Janri: {a['genres']}")
-    if a.get("description"):
-        meta.append(f"\n📝 {a['description']}")
-
-    lock_line = "🔒 Kod bilan yopilgan" if a.get("is_locked", 0) == 1 else "✅ Ochiq"
-    txt = (
-        f"🎬 <b>{a['title']}</b>\n"
-        f"🆔 ID: <code>{a['id']}</code>\n"
-        f"{lock_line}\n"
-        + "\n".join(meta)
-    )
+            await target.answer(txt)
+        else:
+            await target.message.answer(txt)
+        return False
 
-    kb = seasons_kb(anime_id, seasons, is_admin=is_admin(target.from_user.id)) if seasons else None
+    txt, kb = await render.anime_card(anime_id, is_admin(target.from_user.id))
 
     if isinstance(target, Message):
         await target.answer(txt, reply_markup=kb, link_preview_options=LPO_OFF)
     else:
         await target.message.edit_text(txt, reply_markup=kb, link_preview_options=LPO_OFF)
+    return True
 
 
-async def render_episode_page(call: CallbackQuery, anime_id: int, season_no: int, page: int):
-    total = await db.count_episodes(anime_id, season_no)
-    offset = page * PAGE_SIZE
-    eps = await db.list_episode_numbers(anime_id, season_no, offset=offset, limit=PAGE_SIZE)
-    has_prev = page > 0
-    has_next = (offset + PAGE_SIZE) < total
+def count_open(user_id: int, anime_id: int):
+    day = db.day_of(int(time.time()))
+    if counted_opens.get((day, user_id, anime_id)) is None:
+        counted_opens.set((day, user_id, anime_id), True)
+        title_events.add((day, anime_id), (0, 1))
 
-    a = await db.get_anime(anime_id)
-    title = a["title"] if a else "Media"
-    txt = (
-        f"🎬 <b>{title}</b>\n"
-        f"📺 <b>{season_no}-FASL</b>\n"
-        f"Qismlar: {total}\n\n"
-        f"Qismni tanlang:"
-    )
-    kb = episodes_kb(anime_id, season_no, eps, page, has_prev, has_next, is_admin=is_admin(call.from_user.id))
+
+async def render_episode_page(call: CallbackQuery, anime_id: int, season_no: int, start: int):
+    txt, kb = await render.season_page(anime_id, season_no, start, is_admin(call.from_user.id))
     await call.message.edit_text(txt, reply_markup=kb)
 
 
 # ---------- PUBLIC ----------
 @dp.message(CommandStart())
 async def start_cmd(msg: Message):
-    await db.upsert_user(msg.from_user.id, int(time.time()))
+    user_activity.add(msg.from_user.id, int(time.time()))
     args = msg.text.split(maxsplit=1)
 
     if len(args) == 2 and args[1].isdigit():
-        await show_anime(msg, int(args[1]))
+        if await show_anime(msg, int(args[1])):
+            count_open(msg.from_user.id, int(args[1]))
         return
 
     text = (
         "Salom!\n\n"
         "🔎 Qidirish: <code>/search nom</code>\n"
+        "🗂 Janr, yil, davlat bo‘yicha: /browse\n"
+        "🔥 Trenddagilar: /top\n"
         "🔓 Agar kontent kod bilan yopilgan bo‘lsa: <b>3 xonali kod</b> yuboring.\n"
     )
     if is_admin(msg.from_user.id):
         text += "\n👑 Admin menyu: <code>/admin</code>\n"
         text += f"🆔 Sizning admin ID: <code>{ADMIN_ID}</code>\n"
-    await msg.answer(text)
+    recent = await db.recent_progress(msg.from_user.id)
+    if recent:
+        text += "\n📺 Davom ettirish:"
+    await msg.answer(text, reply_markup=continue_kb(recent) if recent else None)
 
 
 @dp.message(Command("myid"))
@@ -197,68 +315,214 @@ async def search_cmd(msg: Message):
     await msg.answer("\n".join(lines))
 
 
-@dp.message(F.text.regexp(r"^\d{3}$"))
+# ---------- TOP ----------
+@dp.message(Command("top"))
+async def top_cmd(msg: Message):
+    await show_ranking(msg, "trending")
+
+
+@cb.router(cb.Top)
+async def top_cb(call: CallbackQuery, callback_data: cb.Top):
+    if callback_data.board in db.BOARDS:
+        await show_ranking(call, callback_data.board)
+    return call.answer()
+
+
+async def show_ranking(target: Message | CallbackQuery, board: str):
+    items = await db.get_ranking(board, limit=10)
+    txt = f"{BOARD_NAMES[board]}:" if items else f"{BOARD_NAMES[board]}: hozircha bo‘sh."
+    kb = ranking_kb(board, items)
+    if isinstance(target, Message):
+        await target.answer(txt, reply_markup=kb)
+    else:
+        try:
+            await target.message.edit_text(txt, reply_markup=kb)
+        except TelegramBadRequest:
+            pass  # same board pressed again: "message is not modified"
+
+
+async def rankings_loop():
+    while True:
+        try:
+            await db.refresh_rankings()
+        except Exception:
+            logging.exception("rankings refresh failed")
+        await asyncio.sleep(RANKINGS_INTERVAL)
+
+
+# ---------- BROWSE ----------
+BROWSE_VALUES_PAGE = 20
+BROWSE_RESULTS_PAGE = 15
+
+
+async def _browse_title(within: int) -> str:
+    if not within:
+        return "🗂 Bo‘limni tanlang:"
+    v = await db.get_facet_value(within)
+    return f"🗂 {v['label'] if v else '?'} — qo‘shimcha bo‘limni tanlang:"
+
+
+@dp.message(Command("browse"))
+async def browse_cmd(msg: Message):
+    await msg.answer(await _browse_title(0), reply_markup=facets_kb())
+
+
+@cb.router(cb.BrowseHome)
+async def browse_home(call: CallbackQuery, callback_data: cb.BrowseHome):
+    await call.message.edit_text(await _browse_title(callback_data.within), reply_markup=facets_kb(callback_data.within))
+    return call.answer()
+
+
+@cb.router(cb.BrowseFacet)
+async def browse_facet(call: CallbackQuery, callback_data: cb.BrowseFacet):
+    facet, within, offset = callback_data.facet, callback_data.within, callback_data.offset
+    if facet not in db.FACETS:
+        return call.answer()
+    values = await db.facet_values(facet, within, offset, BROWSE_VALUES_PAGE + 1)
+    has_more = len(values) > BROWSE_VALUES_PAGE
+    values = values[:BROWSE_VALUES_PAGE]
+    if not values:
+        return call.answer("Bu bo‘limda hech narsa yo‘q.", show_alert=True)
+    kb = facet_values_kb(facet, within, values, offset, BROWSE_VALUES_PAGE, has_more)
+    await call.message.edit_text(f"{FACET_NAMES[facet]}:", reply_markup=kb)
+    return call.answer()
+
+
+@cb.router(cb.BrowseValue)
+async def browse_value(call: CallbackQuery, callback_data: cb.BrowseValue):
+    value_id, within = callback_data.value_id, callback_data.within
+    v = await db.get_facet_value(value_id)
+    if not v:
+        return call.answer("Bu tugma eskirgan.")
+    items = await db.browse_anime(value_id, within, callback_data.after, BROWSE_RESULTS_PAGE + 1)
+    next_after = items[BROWSE_RESULTS_PAGE - 1][0] if len(items) > BROWSE_RESULTS_PAGE else None
+    items = items[:BROWSE_RESULTS_PAGE]
+    head = v["label"]
+    if within:
+        w = await db.get_facet_value(within)
+        head = f"{w['label']} + {head}" if w else head
+    else:
+        head = f"{head} ({v['count']})"
+    txt = f"🗂 <b>{head}</b>\n\nAnimeni tanlang:" if items else f"🗂 <b>{head}</b>\n\nHech narsa topilmadi."
+    await call.message.edit_text(txt, reply_markup=browse_results_kb(value_id, within, items, next_after))
+    return call.answer()
+
+
+INLINE_PAGE = 20
+INLINE_CACHE_TIME = 300
+
+
+@dp.inline_query()
+async def inline_search(query: InlineQuery):
+    # the answer rides in the webhook response like callback answers do
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    q = query.query.strip()
+    items = await db.search_anime(q, limit=INLINE_PAGE + 1, offset=offset) if q else []
+    more = len(items) > INLINE_PAGE
+    results = [render.anime_article(a, identity.deep_link(a["id"])) for a in items[:INLINE_PAGE]]
+    return query.answer(
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(offset + INLINE_PAGE) if more else "",
+    )
+
+
+# outside any flow only: admin prompts (broadcast days, season/episode
+# numbers, lock codes) take 3-digit answers too
+@dp.message(StateFilter(None), F.text.regexp(r"^\d{3}$"))
 async def unlock_by_code(msg: Message):
-    a = await db.get_anime_by_code(msg.text.strip())
-    if not a:
+    user_id = msg.from_user.id
+    if not is_admin(user_id):
+        wait = code_attempts.hit(user_id)
+        if wait:
+            return await msg.answer(f"⏳ Juda ko‘p urinish. {math.ceil(wait)} soniyadan keyin qayta urinib ko‘ring.")
+    code = msg.text.strip()
+    anime_id = db.anime_id_by_code(code)
+    if anime_id is None:
         return await msg.answer("❌ Kod xato yoki topilmadi.")
-    await show_anime(msg, int(a["id"]))
+    if not await db.has_unlocked(user_id, anime_id, code):
+        await db.record_unlock(user_id, anime_id, code)
+    await show_anime(msg, anime_id)
 
 
 # ---------- CALLBACKS ----------
-@dp.callback_query(F.data == "noop")
+# Every button goes through cb.router: one prefix lookup instead of a
+# filter per handler (see callbacks.py).
+dp.callback_query.register(cb.router.dispatch)
+
+
+# Public callbacks return call.answer() instead of awaiting it: under polling
+# aiogram sends it right away, in webhook mode it rides in the HTTP response.
+@cb.router(cb.Noop)
 async def noop(call: CallbackQuery):
-    await call.answer()
+    return call.answer()
 
 
-@dp.callback_query(F.data.startswith("back:"))
-async def back_to_seasons(call: CallbackQuery):
-    _, anime_id = call.data.split(":")
-    await show_anime(call, int(anime_id))
-    await call.answer()
+@cb.router(cb.Back)
+@cb.router(cb.OpenAnime)
+async def back_to_seasons(call: CallbackQuery, callback_data: cb.Back | cb.OpenAnime):
+    await show_anime(call, callback_data.anime_id)
+    return call.answer()
 
 
-@dp.callback_query(F.data.startswith("s:"))
-async def open_season(call: CallbackQuery):
-    _, anime_id, season_no = call.data.split(":")
-    await render_episode_page(call, int(anime_id), int(season_no), page=0)
-    await call.answer()
+@cb.router(cb.Season)
+async def open_season(call: CallbackQuery, callback_data: cb.Season):
+    await render_episode_page(call, callback_data.anime_id, callback_data.season_no, start=0)
+    return call.answer()
 
 
-@dp.callback_query(F.data.startswith("p:"))
-async def paginate(call: CallbackQuery):
-    _, anime_id, season_no, page = call.data.split(":")
-    await render_episode_page(call, int(anime_id), int(season_no), int(page))
-    await call.answer()
+@cb.router(cb.Page)
+async def paginate(call: CallbackQuery, callback_data: cb.Page):
+    await render_episode_page(call, callback_data.anime_id, callback_data.season_no, callback_data.start)
+    return call.answer()
 
 
-@dp.callback_query(F.data.startswith("e:"))
-async def send_episode(call: CallbackQuery):
-    _, anime_id, season_no, episode_no = call.data.split(":")
-    anime_id = int(anime_id)
-    season_no = int(season_no)
-    episode_no = int(episode_no)
+@cb.router(cb.Jump)
+async def jump_to_range(call: CallbackQuery, callback_data: cb.Jump):
+    txt, kb = await render.season_ranges(callback_data.anime_id, callback_data.season_no)
+    await call.message.edit_text(txt, reply_markup=kb)
+    return call.answer()
+
+
+@cb.router(cb.Episode)
+async def send_episode(call: CallbackQuery, callback_data: cb.Episode):
+    anime_id = callback_data.anime_id
+    season_no = callback_data.season_no
+    episode_no = callback_data.episode_no
 
     a = await db.get_anime(anime_id)
-    if a and a.get("is_locked", 0) == 1 and not is_admin(call.from_user.id):
-        await call.answer("🔒 Kod bilan yopilgan. 3 xonali kod yuboring.", show_alert=True)
-        return
+    if a and not await can_view(call.from_user.id, a):
+        return call.answer("🔒 Kod bilan yopilgan. 3 xonali kod yuboring.", show_alert=True)
 
     data = await db.get_episode(anime_id, season_no, episode_no)
     if not data:
-        await call.answer("Topilmadi.", show_alert=True)
-        return
+        return call.answer("Topilmadi.", show_alert=True)
 
-    file_id, cap = data
+    file_id, cap, media_type, next_no = data
     title = a["title"] if a else "Media"
-    caption = cap or f"🎬 {title}\n📺 {season_no}-FASL • {episode_no}-qism"
-
-    try:
-        await call.message.answer_video(file_id, caption=caption)
-    except Exception:
-        await call.message.answer_document(file_id, caption=caption)
+    caption = cap or render.episode_caption(title, season_no, episode_no)
+    # next_no comes with the episode row, so bingeing costs one lookup per episode
+    kb = next_episode_kb(anime_id, season_no, next_no)
+
+    if media_type == "video":
+        await call.message.answer_video(file_id, caption=caption, reply_markup=kb)
+    elif media_type == "document":
+        await call.message.answer_document(file_id, caption=caption, reply_markup=kb)
+    else:
+        # saved before media types were tracked: find out once and remember
+        try:
+            await call.message.answer_video(file_id, caption=caption, reply_markup=kb)
+            media_type = "video"
+        except TelegramBadRequest:
+            await call.message.answer_document(file_id, caption=caption, reply_markup=kb)
+            media_type = "document"
+        await db.set_media_types([(anime_id, season_no, episode_no, media_type)])
 
-    await call.answer()
+    now = int(time.time())
+    title_events.add((db.day_of(now), anime_id), (1, 0))
+    watch_progress.add((call.from_user.id, anime_id), (now, season_no, episode_no))
+    return call.answer()
 
 
 # ---------- ADMIN ----------
@@ -270,7 +534,7 @@ async def admin_cmd(msg: Message):
 
 
 # --- Admin: Anime qo‘shish ---
-@dp.callback_query(F.data == "admin:add_anime")
+@cb.router(cb.Admin, "add_anime")
 async def admin_add_anime(call: CallbackQuery, state: FSMContext):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
@@ -333,8 +597,7 @@ async def st_desc(msg: Message, state: FSMContext):
     )
 
     await state.clear()
-    me = await bot.get_me()
-    deep = f"https://t.me/{me.username}?start={anime_id}"
+    deep = identity.deep_link(anime_id)
     await msg.answer(
         f"✅ Saqlandi!\n🆔 Anime ID: <code>{anime_id}</code>\n🔗 Link: {deep}",
         link_preview_options=LPO_OFF,
@@ -342,12 +605,11 @@ async def st_desc(msg: Message, state: FSMContext):
 
 
 # --- Admin: Fasl qo‘shish ---
-@dp.callback_query(F.data.startswith("admin:add_season:"))
-async def admin_add_season_cb(call: CallbackQuery, state: FSMContext):
+@cb.router(cb.AddSeason)
+async def admin_add_season_cb(call: CallbackQuery, state: FSMContext, callback_data: cb.AddSeason):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
-    _, _, anime_id = call.data.split(":")
-    await state.update_data(anime_id=int(anime_id))
+    await state.update_data(anime_id=callback_data.anime_id)
     await state.set_state(AddSeason.season_no)
     await call.message.answer("➕ Qaysi fasl raqamini qo‘shamiz? (1/2/3...)")
     await call.answer()
@@ -366,7 +628,7 @@ async def add_season_no(msg: Message, state: FSMContext):
 
 
 # --- Admin: Qism qo‘shish ---
-@dp.callback_query(F.data == "admin:add_ep")
+@cb.router(cb.Admin, "add_ep")
 async def admin_add_ep(call: CallbackQuery, state: FSMContext):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
@@ -397,19 +659,25 @@ async def ep_season(msg: Message, state: FSMContext):
     await db.ensure_season(data["anime_id"], season_no)
     await state.update_data(season_no=season_no)
     await state.set_state(AddEpisode.mode)
-    await msg.answer("Raqamlash:\n1) <b>auto</b>\n2) <b>manual</b>\n\nJavob: <code>auto</code> yoki <code>manual</code>")
+    await msg.answer(
+        "Raqamlash:\n1) <b>auto</b>\n2) <b>manual</b>\n"
+        "3) <b>bulk</b> — albom yoki ko‘p videoni birdan forward qiling\n\n"
+        "Javob: <code>auto</code>, <code>manual</code> yoki <code>bulk</code>"
+    )
 
 
 @dp.message(AddEpisode.mode)
 async def ep_mode(msg: Message, state: FSMContext):
     m = msg.text.strip().lower()
-    if m not in ("auto", "manual"):
-        return await msg.answer("Faqat <code>auto</code> yoki <code>manual</code> yoz.")
+    if m not in ("auto", "manual", "bulk"):
+        return await msg.answer("Faqat <code>auto</code>, <code>manual</code> yoki <code>bulk</code> yoz.")
     await state.update_data(mode=m)
     if m == "manual":
         await state.set_state(AddEpisode.episode_no)
         return await msg.answer("Nechinchi qism? (raqam)")
     await state.set_state(AddEpisode.waiting_video)
+    if m == "bulk":
+        return await msg.answer("🎞 Videolarni albom qilib yoki birdan forward qilib yubor. Oxirida bitta hisobot keladi.")
     await msg.answer("🎞 Endi video yubor. (Auto raqam o‘zi qo‘yiladi)")
 
 
@@ -427,8 +695,8 @@ async def ep_video(msg: Message, state: FSMContext):
     if not is_admin(msg.from_user.id):
         return
 
-    file_id = msg.video.file_id if msg.video else (msg.document.file_id if msg.document else None)
-    if not file_id:
+    media = media_of(msg)
+    if not media:
         return await msg.answer("Video yoki fayl yubor. (Telegram video/doc)")
 
     data = await state.get_data()
@@ -436,16 +704,30 @@ async def ep_video(msg: Message, state: FSMContext):
     season_no = data["season_no"]
     mode = data["mode"]
 
-    ep_no_ = await db.next_episode_no(anime_id, season_no) if mode == "auto" else data["episode_no"]
+    # albums and forwarded runs are numbered and saved together in save_uploads
+    if mode == "bulk" or (mode == "auto" and msg.media_group_id):
+        uploads.add((msg.chat.id, anime_id, season_no), (msg.message_id, media))
+        return
 
     a = await db.get_anime(anime_id)
     title = a["title"] if a else "Media"
-    caption = f"🎬 {title}\n📺 {season_no}-FASL • {ep_no_}-qism"
 
-    await db.add_or_replace_episode(anime_id, season_no, ep_no_, file_id, caption=caption)
+    if mode == "auto":
+        [ep_no_] = await db.add_episodes(
+            anime_id, season_no, [media],
+            caption_for=lambda n: render.episode_caption(title, season_no, n),
+        )
+    else:
+        ep_no_ = data["episode_no"]
+        caption = render.episode_caption(title, season_no, ep_no_)
+        await db.add_or_replace_episode(
+            anime_id, season_no, ep_no_, media.file_id, caption=caption,
+            media_type=media.media_type, duration=media.duration, file_size=media.file_size,
+        )
+    if PRERENDER_ON_ADD:
+        prerenders.add((anime_id, season_no), None)
 
-    me = await bot.get_me()
-    deep = f"https://t.me/{me.username}?start={anime_id}"
+    deep = identity.deep_link(anime_id)
 
     await msg.answer(
         f"✅ Saqlandi: ID <code>{anime_id}</code> | {season_no}-fasl | {ep_no_}-qism\n"
@@ -455,8 +737,49 @@ async def ep_video(msg: Message, state: FSMContext):
     )
 
 
+async def save_uploads(key: tuple[int, int, int], items: list[tuple[int, db.Media]]):
+    chat_id, anime_id, season_no = key
+    items.sort()  # message_id order == upload order
+    a = await db.get_anime(anime_id)
+    title = a["title"] if a else "Media"
+
+    try:
+        numbers = await db.add_episodes(
+            anime_id, season_no, [media for _, media in items],
+            caption_for=lambda n: render.episode_caption(title, season_no, n),
+        )
+    except Exception:
+        logging.exception("saving %s uploads for anime %s failed", len(items), anime_id)
+        return await bot.send_message(
+            chat_id,
+            f"⚠️ {len(items)} ta qism saqlanmadi (ID <code>{anime_id}</code> | {season_no}-fasl). "
+            "Qayta yuboring, logni qarang.",
+        )
+    if PRERENDER_ON_ADD:
+        prerenders.add((anime_id, season_no), None)
+
+    deep = identity.deep_link(anime_id)
+    await bot.send_message(
+        chat_id,
+        f"✅ Saqlandi: ID <code>{anime_id}</code> | {season_no}-fasl | "
+        f"{numbers[0]}–{numbers[-1]}-qism ({len(numbers)} ta)\n"
+        f"🔗 Link: {deep}",
+        link_preview_options=LPO_OFF,
+    )
+
+
+uploads = Debounce(save_uploads, delay=2.0, max_items=200)
+
+
+async def _prerender(key: tuple[int, int], _uploads: list):
+    await render.prerender_season(*key)
+
+
+prerenders = Debounce(_prerender, delay=PRERENDER_DELAY, max_items=1000)
+
+
 # --- Admin: Kod bilan yopish ---
-@dp.callback_query(F.data == "admin:lock")
+@cb.router(cb.Admin, "lock")
 async def lock_menu(call: CallbackQuery, state: FSMContext):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
@@ -502,13 +825,16 @@ async def lock_code(msg: Message, state: FSMContext):
         return await msg.answer("Kod 3 xonali raqam bo‘lsin. Masalan: 739")
     data = await state.get_data()
     anime_id = int(data["anime_id"])
+    owner = db.anime_id_by_code(code)
+    if owner is not None and owner != anime_id:
+        return await msg.answer(f"Bu kod allaqachon ID {owner} uchun ishlatilgan. Boshqa kod yuboring.")
     await db.set_anime_lock(anime_id, 1, code)
     await state.clear()
     await msg.answer("✅ Yopildi. Endi foydalanuvchi 3 xonali kod yuborsa ochiladi.")
 
 
 # --- Admin: Anime tahrirlash ---
-@dp.callback_query(F.data == "admin:edit_anime")
+@cb.router(cb.Admin, "edit_anime")
 async def edit_anime_start(call: CallbackQuery, state: FSMContext):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
@@ -552,12 +878,11 @@ async def edit_anime_value(msg: Message, state: FSMContext):
 
 
 # --- Admin: Epizod tahrirlash (fasldan) ---
-@dp.callback_query(F.data.startswith("admin:edit_ep:"))
-async def edit_ep_from_season(call: CallbackQuery, state: FSMContext):
+@cb.router(cb.EditEpisodes)
+async def edit_ep_from_season(call: CallbackQuery, state: FSMContext, callback_data: cb.EditEpisodes):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
-    _, _, anime_id, season_no = call.data.split(":")
-    await state.update_data(anime_id=int(anime_id), season_no=int(season_no))
+    await state.update_data(anime_id=callback_data.anime_id, season_no=callback_data.season_no)
     await state.set_state(EditEpisode.episode_no)
     await call.message.answer("✏️ Qaysi epizod? (qism raqamini yubor)")
     await call.answer()
@@ -614,8 +939,8 @@ async def edit_ep_file(msg: Message, state: FSMContext):
     if not is_admin(msg.from_user.id):
         return
 
-    file_id = msg.video.file_id if msg.video else (msg.document.file_id if msg.document else None)
-    if not file_id:
+    media = media_of(msg)
+    if not media:
         return await msg.answer("Video yoki document yubor.")
 
     data = await state.get_data()
@@ -623,13 +948,13 @@ async def edit_ep_file(msg: Message, state: FSMContext):
     season_no = int(data["season_no"])
     ep_no = int(data["episode_no"])
 
-    await db.update_episode_file(anime_id, season_no, ep_no, file_id)
+    await db.update_episode_file(anime_id, season_no, ep_no, *media)
     await state.clear()
     await msg.answer("✅ Fayl (video) almashtirildi.")
 
 
 # --- Admin: Post shabloni ---
-@dp.callback_query(F.data == "admin:post")
+@cb.router(cb.Admin, "post")
 async def post_start(call: CallbackQuery, state: FSMContext):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
@@ -660,8 +985,7 @@ async def post_season(msg: Message, state: FSMContext):
     anime_id = int(data["anime_id"])
 
     a = await db.get_anime(anime_id)
-    me = await bot.get_me()
-    deep = f"https://t.me/{me.username}?start={anime_id}"
+    deep = identity.deep_link(anime_id)
 
     text = (
         f"🎬 <b>{a['title']}</b>\n"
@@ -673,26 +997,293 @@ async def post_season(msg: Message, state: FSMContext):
     await msg.answer(text, link_preview_options=LPO_OFF)
 
 
+# --- Admin: Tarqatish ---
+@cb.router(cb.Admin, "broadcast")
+async def broadcast_start(call: CallbackQuery, state: FSMContext):
+    if not is_admin(call.from_user.id):
+        return await call.answer("Admin emassiz.", show_alert=True)
+    await state.set_state(BroadcastFlow.content)
+    await call.message.answer(
+        "📣 Tarqatiladigan xabarni yubor (matn, rasm, video...).\n"
+        "Epizod yuborish uchun: <code>ep ANIME_ID FASL QISM</code>"
+    )
+    await call.answer()
+
+
+@dp.message(BroadcastFlow.content)
+async def broadcast_content(msg: Message, state: FSMContext):
+    m = re.fullmatch(r"ep\s+(\d+)\s+(\d+)\s+(\d+)", (msg.text or "").strip().lower())
+    if m:
+        anime_id, season_no, ep_no = map(int, m.groups())
+        if not await db.get_episode(anime_id, season_no, ep_no):
+            return await msg.answer("Bunday qism topilmadi.")
+        payload = broadcast.episode_payload(anime_id, season_no, ep_no)
+    else:
+        payload = broadcast.copy_payload(msg.chat.id, msg.message_id)
+    await state.update_data(payload=payload)
+    await state.set_state(BroadcastFlow.segment)
+    await msg.answer(
+        "Kimlarga yuboramiz?\n"
+        "<code>all</code> — hamma\n"
+        "<code>7</code> — oxirgi 7 kunda faol bo‘lganlar"
+    )
+
+
+@dp.message(BroadcastFlow.segment)
+async def broadcast_segment(msg: Message, state: FSMContext):
+    seg = msg.text.strip().lower()
+    if seg == "all":
+        active_since = None
+    elif seg.isdigit():
+        active_since = int(time.time()) - int(seg) * 86400
+    else:
+        return await msg.answer("<code>all</code> yoki kunlar soni yubor.")
+    data = await state.get_data()
+    await state.clear()
+    b = await broadcast.start(bot, data["payload"], msg.chat.id, active_since)
+    spawn(b.run())
+
+
+async def resume_broadcasts_loop():
+    # broadcasts left running by a restart, or by a process that died: run()
+    # claims each one and skips those another live process still owns
+    while True:
+        try:
+            for b in await broadcast.resume_running(bot):
+                spawn(b.run())
+        except Exception:
+            logging.exception("resuming broadcasts failed")
+        await asyncio.sleep(broadcast.CLAIM_TIMEOUT)
+
+
+@cb.router(cb.BroadcastAction, "stop")
+async def broadcast_stop(call: CallbackQuery, callback_data: cb.BroadcastAction):
+    if not is_admin(call.from_user.id):
+        return await call.answer("Admin emassiz.", show_alert=True)
+    stopped = await broadcast.stop(callback_data.broadcast_id)
+    await call.answer("⛔ To‘xtatilmoqda..." if stopped else "Allaqachon tugagan.")
+
+
+# --- Admin: Manifest import ---
+# getFile only serves files up to 20 MB unless a local Bot API server is used
+MANIFEST_MAX_BYTES = 2000 * 1024 * 1024 if BOT_API_URL else 20 * 1024 * 1024
+_import_lock = asyncio.Lock()
+
+
+@dp.message(Command("import"))
+async def import_cmd(msg: Message, state: FSMContext):
+    if not is_admin(msg.from_user.id):
+        return await msg.answer("Kechirasiz, admin emassiz.")
+    await ask_manifest(msg, state)
+
+
+@cb.router(cb.Admin, "import")
+async def import_menu(call: CallbackQuery, state: FSMContext):
+    if not is_admin(call.from_user.id):
+        return await call.answer("Admin emassiz.", show_alert=True)
+    await ask_manifest(call.message, state)
+    await call.answer()
+
+
+async def ask_manifest(msg: Message, state: FSMContext):
+    await state.set_state(ImportFlow.manifest)
+    await msg.answer(
+        "📥 Katalog manifestini yubor (<code>.jsonl</code> yoki <code>.csv</code>, hujjat sifatida).\n"
+        "Ustunlar: <code>anime_id, title, year, country, language, genres, description, "
+        "lock_code, season_no, episode_no, file_id, media_type, caption</code>"
+    )
+
+
+@dp.message(ImportFlow.manifest)
+async def import_manifest(msg: Message, state: FSMContext):
+    doc = msg.document
+    if not doc:
+        return await msg.answer("Faylni hujjat qilib yubor.")
+    if (doc.file_size or 0) > MANIFEST_MAX_BYTES:
+        return await msg.answer("Fayl juda katta. Serverda <code>python importer.py FAYL</code> bilan yuklang.")
+    if _import_lock.locked():
+        return await msg.answer("⏳ Boshqa import hali tugamadi.")
+    await state.clear()
+    spawn(run_import(msg.chat.id, doc))
+
+
+async def run_import(chat_id: int, doc):
+    async with _import_lock:
+        fd, path = tempfile.mkstemp(prefix="manifest-", suffix=os.path.splitext(doc.file_name or "")[1])
+        os.close(fd)
+        status = None
+
+        async def report(text: str):
+            try:
+                await bot.edit_message_text(text, chat_id=chat_id, message_id=status.message_id, parse_mode=None)
+            except TelegramBadRequest:
+                pass  # "message is not modified"
+
+        try:
+            status = await bot.send_message(chat_id, "📥 Fayl yuklab olinmoqda...")
+            await bot.download(doc, destination=path, timeout=300)
+            imp = await importer.ManifestImport(path, progress=lambda imp: report(imp.summary())).run()
+            await report(imp.summary(done=True))
+            if imp.error_count:
+                await bot.send_document(chat_id, BufferedInputFile(imp.error_report().encode(), "import-errors.txt"))
+        except Exception:
+            logging.exception("manifest import failed")
+            await bot.send_message(chat_id, "⚠️ Import xato bilan to‘xtadi, logni qarang.")
+        finally:
+            os.remove(path)
+
+
+# --- Admin: Zaxira nusxa / eksport ---
+@cb.router(cb.Admin, "backup")
+async def backup_cb(call: CallbackQuery):
+    if not is_admin(call.from_user.id):
+        return await call.answer("Admin emassiz.", show_alert=True)
+    spawn(run_backup(call.message.chat.id))
+    await call.answer("⏳ Zaxira nusxa olinmoqda...")
+
+
+@cb.router(cb.Admin, "export")
+async def export_cb(call: CallbackQuery):
+    if not is_admin(call.from_user.id):
+        return await call.answer("Admin emassiz.", show_alert=True)
+    spawn(run_export(call.message.chat.id))
+    await call.answer("⏳ Katalog eksport qilinmoqda...")
+
+
+async def run_backup(chat_id: int):
+    started = time.monotonic()
+    try:
+        path = await backup.make_backup(BACKUP_DIR, keep=BACKUP_KEEP)
+    except Exception:
+        logging.exception("backup failed")
+        return await bot.send_message(chat_id, "⚠️ Zaxira nusxa olinmadi, logni qarang.")
+    await bot.send_message(
+        chat_id,
+        f"💾 Zaxira nusxa: <code>{path}</code>\n"
+        f"📦 {os.path.getsize(path) / 2 ** 20:.1f} MB, ⏱ {time.monotonic() - started:.1f}s",
+    )
+
+
+# sendDocument accepts up to 50 MB
+EXPORT_SEND_MAX = 50 * 1024 * 1024
+
+
+async def run_export(chat_id: int):
+    try:
+        path, n_anime, n_episodes = await backup.make_export(BACKUP_DIR, keep=BACKUP_KEEP)
+    except Exception:
+        logging.exception("catalogue export failed")
+        return await bot.send_message(chat_id, "⚠️ Eksport xato bilan to‘xtadi, logni qarang.")
+    caption = f"📤 Katalog: {n_anime} anime, {n_episodes} qism"
+    if os.path.getsize(path) <= EXPORT_SEND_MAX:
+        await bot.send_document(chat_id, FSInputFile(path), caption=caption)
+    else:
+        await bot.send_message(chat_id, f"{caption}\n<code>{path}</code>")
+
+
+async def backup_loop():
+    while True:
+        await asyncio.sleep(BACKUP_EVERY_HOURS * 3600)
+        try:
+            path = await backup.make_backup(BACKUP_DIR, keep=BACKUP_KEEP)
+            logging.info("backup written to %s", path)
+        except Exception:
+            logging.exception("scheduled backup failed")
+
+
 # --- Admin: Statistika ---
-@dp.callback_query(F.data == "admin:stats")
+@cb.router(cb.Admin, "stats")
 async def stats_cb(call: CallbackQuery):
     if not is_admin(call.from_user.id):
         return await call.answer("Admin emassiz.", show_alert=True)
     s = await db.stats()
-    await call.message.answer(
-        "📊 Statistika:\n"
-        f"👥 Userlar: <b>{s['users']}</b>\n"
-        f"🎬 Anime: <b>{s['anime']}</b>\n"
-        f"🎞 Epizodlar: <b>{s['episodes']}</b>\n"
-    )
+    q = limiter.snapshot()
+    lines = [
+        "📊 Statistika:",
+        f"👥 Userlar: <b>{s.get('users', 0)}</b>",
+        f"🎬 Anime: <b>{s.get('anime', 0)}</b>",
+        f"🎞 Epizodlar: <b>{s.get('episodes', 0)}</b>",
+        "",
+        "📈 Oxirgi 7 kun (faol / yangi / ko‘rish):",
+    ]
+    for day, active, new, views in reversed(s["daily"]):
+        lines.append(f"<code>{time.strftime('%d.%m', time.gmtime(day * db.DAY))}</code>  {active} / +{new} / {views}")
+    if s["top"]:
+        lines += ["", "🔥 Ko‘p ko‘rilgan (7 kun):"]
+        lines += [f"• {title} — {n}" for _, title, n in s["top"]]
+    lines += [
+        "",
+        f"📤 Navbat: {q['queue_normal']} oddiy, {q['queue_bulk']} ommaviy, {q['waiting_per_chat']} chat kutmoqda",
+        f"⏳ Flood-wait: {q['flood_waits']}",
+    ]
+    await call.message.answer("\n".join(lines))
     await call.answer()
 
 
 # ---------- STARTUP ----------
+async def startup(primary: bool = True, index: int = 0):
+    # primary: the one process (of several workers) that runs singleton jobs
+    await db.init_db()
+    global _metrics_runner
+    if METRICS_PORT and _metrics_runner is None:
+        _metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT + index)
+    await identity.load(bot)
+    spawn(identity.refresh_loop(bot))
+    user_activity.start()
+    title_events.start()
+    watch_progress.start()
+    # also in a lone process: importer.py may write to the database from a shell
+    spawn(workers.cache_sync_loop(prune=primary))
+    if primary:
+        spawn(rankings_loop())
+        if BACKUP_EVERY_HOURS > 0:
+            spawn(backup_loop())
+        spawn(resume_broadcasts_loop())
+
+
+async def shutdown():
+    global _metrics_runner
+    tasks = list(_bg_tasks)
+    for task in tasks:
+        task.cancel()
+    # let cancelled jobs (e.g. broadcasts) write their checkpoints
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await uploads.drain()
+    await user_activity.stop()
+    await title_events.stop()
+    await watch_progress.stop()
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+    await db.close_db()
+
+
 async def main():
     logging.basicConfig(level=logging.INFO)
-    await db.init_db()
-    await dp.start_polling(bot)
+    if BOT_MODE == "polling" and WORKERS > 1:
+        await workers.run_supervisor(bot, dp, WORKERS)
+        return
+
+    try:
+        # several webhook instances may sit behind one load balancer; inside
+        # the try so a failed startup (e.g. getMe unreachable) still closes
+        # the database, whose threads would otherwise keep the process alive
+        await startup(primary=PRIMARY)
+        if BOT_MODE == "webhook":
+            await webhook.run_webhook(
+                dp, bot,
+                host=WEBHOOK_HOST,
+                port=WEBHOOK_PORT,
+                path=WEBHOOK_PATH,
+                secret=WEBHOOK_SECRET,
+                url=WEBHOOK_URL,
+                reply_in_response=WEBHOOK_REPLY,
+            )
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await shutdown()
+        await bot.session.close()
 
 
 if __name__ == "__main__":
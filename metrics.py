@@ -0,0 +1,256 @@
+"""Handler, database and Bot API timings in Prometheus text format.
+
+Everything is kept in-process and served by `serve()` on a local port, so no
+extra dependency is needed. With several workers each process serves its own
+port and Prometheus sums them.
+"""
+import functools
+import inspect
+import logging
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.filters import Command
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+log = logging.getLogger(__name__)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# what the update being handled has done so far: [(kind, what, seconds), ...]
+_trace: ContextVar[list | None] = ContextVar("update_trace", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name, self.doc, self.label_names = name, doc, labels
+        self.values: dict[tuple, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_labels(self.label_names, k)} {v}" for k, v in sorted(self.values.items())]
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = (), buckets: tuple = BUCKETS):
+        self.name, self.doc, self.label_names, self.buckets = name, doc, labels, buckets
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self.values: dict[tuple, list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                row[i] += 1
+        row[-2] += 1
+        row[-1] += value
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        names = (*self.label_names, "le")
+        for k, row in sorted(self.values.items()):
+            for upper, n in zip(self.buckets, row):
+                out.append(f"{self.name}_bucket{_labels(names, (*k, upper))} {n}")
+            out.append(f"{self.name}_bucket{_labels(names, (*k, '+Inf'))} {row[-2]}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {row[-2]}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {row[-1]}")
+        return out
+
+
+REGISTRY: list = []
+# name -> zero-argument callable returning {label value: number} or a number
+GAUGES: dict[str, tuple[str, Callable[[], Any]]] = {}
+
+update_seconds = Histogram("bot_update_seconds", "Time to handle one update", ("handler",))
+update_errors = Counter("bot_update_errors_total", "Updates whose handler raised", ("handler",))
+db_seconds = Histogram("bot_db_call_seconds", "db.* call duration, cache hits included", ("fn",))
+api_seconds = Histogram("bot_api_request_seconds", "Bot API request duration", ("method",))
+api_errors = Counter("bot_api_errors_total", "Failed Bot API requests", ("method", "error"))
+
+
+def gauge(name: str, doc: str, read: Callable[[], Any]):
+    GAUGES[name] = (doc, read)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for name, (doc, read) in GAUGES.items():
+        try:
+            value = read()
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {doc}", f"# TYPE {name} gauge"]
+        if isinstance(value, dict):
+            lines += [f'{name}{{key="{_escape(k)}"}} {v}' for k, v in value.items()]
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------- handlers ----------
+def commands_of(router: Router) -> frozenset[str]:
+    """Command names with a message handler in `router` or its sub-routers."""
+    names = set()
+    for handler in router.message.handlers:
+        for f in handler.filters or ():
+            if isinstance(f.callback, Command):
+                names.update(c for c in f.callback.commands if isinstance(c, str))
+    for sub in router.sub_routers:
+        names |= commands_of(sub)
+    return frozenset(names)
+
+
+def handler_label(update: Update, commands: frozenset[str] = frozenset(),
+                  callback_key: Callable[[str], str | None] | None = None) -> str:
+    """`/start`, `code`, `text`, `video`, ... for messages; the route of
+    callbacks (`cb:p`, `cb:admin:stats`, `cb:editep`); otherwise the update
+    type. Commands not in `commands` and callback data `callback_key` does not
+    know are labelled `other`, so users cannot create new series."""
+    if update.message:
+        text = update.message.text or ""
+        if text.startswith("/"):
+            command = text.split(maxsplit=1)[0].split("@")[0]
+            return command if command[1:] in commands else "other"
+        if text.isdigit() and len(text) == 3:
+            return "code"
+        return "text" if text else (update.message.content_type or "message")
+    if update.callback_query:
+        key = callback_key(update.callback_query.data or "") if callback_key else None
+        return "cb:" + (key or "other")
+    return update.event_type
+
+
+class UpdateMetrics(BaseMiddleware):
+    """Outer update middleware: times every update by handler label and logs
+    the db/API trace of updates slower than `slow_ms` (0 = never). Label
+    values come from the commands registered on `router` and from
+    `callback_key` (see handler_label)."""
+
+    def __init__(self, slow_ms: float = 0, router: Router | None = None,
+                 callback_key: Callable[[str], str | None] | None = None):
+        self.slow_ms = slow_ms
+        self.router = router
+        self.callback_key = callback_key
+        self._commands: frozenset[str] | None = None
+
+    def label(self, update: Update) -> str:
+        if self._commands is None:
+            # handlers are registered after this middleware; read them on first use
+            self._commands = commands_of(self.router) if self.router else frozenset()
+        return handler_label(update, self._commands, self.callback_key)
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        label = self.label(event) if isinstance(event, Update) else type(event).__name__
+        trace: list = []
+        token = _trace.set(trace)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update_errors.inc(label)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            _trace.reset(token)
+            update_seconds.observe(elapsed, label)
+            if self.slow_ms and elapsed * 1000 >= self.slow_ms:
+                steps = "\n".join(f"  {kind:<4} {what} {sec * 1000:.1f}ms" for kind, what, sec in trace)
+                log.warning("slow update %s: %.0fms\n%s", label, elapsed * 1000, steps or "  (no db/api calls)")
+
+
+# ---------- database ----------
+def _record(kind: str, what: str, seconds: float):
+    trace = _trace.get()
+    if trace is not None and len(trace) < 200:
+        trace.append((kind, what, seconds))
+
+
+def _timed(fn, name: str, show_sql: bool):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            db_seconds.observe(elapsed, name)
+            if show_sql:
+                _record("sql", " ".join(str(args[0]).split()), elapsed)
+            else:
+                _record("db", f"{name}{args!r}"[:160], elapsed)
+    wrapper.__metrics_wrapped__ = True
+    return wrapper
+
+
+def instrument_db(module, sql_helpers: tuple[str, ...] = ("_fetchone", "_fetchall"),
+                  skip: tuple[str, ...] = ("init_db", "close_db")):
+    """Wrap every public coroutine function of the db module (plus its read
+    helpers, whose SQL ends up in the slow-update trace). Module globals are
+    replaced, so calls between db functions are timed too."""
+    for name, fn in list(vars(module).items()):
+        if name in skip or not inspect.iscoroutinefunction(fn) or getattr(fn, "__metrics_wrapped__", False):
+            continue
+        if name in sql_helpers:
+            setattr(module, name, _timed(fn, name, show_sql=True))
+        elif not name.startswith("_") and fn.__module__ == module.__name__:
+            setattr(module, name, _timed(fn, name, show_sql=False))
+
+
+# ---------- Bot API ----------
+class ApiMetrics(BaseRequestMiddleware):
+    """Session middleware timing Bot API requests by method. Register it after
+    the rate limiter so queueing is not counted as Telegram latency."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Response:
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            api_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            api_seconds.observe(elapsed, name)
+            _record("api", name, elapsed)
+
+
+# ---------- HTTP ----------
+async def serve(host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("Metrics: http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, AnswerInlineQuery, Response, TelegramMethod
+
+log = logging.getLogger(__name__)
+
+# lower value = sent first
+PRIORITY_ANSWER = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BULK = 2
+
+_priority: ContextVar[int] = ContextVar("send_priority", default=PRIORITY_NORMAL)
+
+_ANSWERS = (AnswerCallbackQuery, AnswerInlineQuery)
+
+
+@contextmanager
+def bulk():
+    """Requests made inside this block yield to interactive traffic."""
+    token = _priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def delay(self) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def reserve(self) -> float:
+        """Take a token now, possibly going into debt; return how long the
+        caller must wait before using it. Callers are served FIFO."""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 0:
+            wait = max(wait, -self.tokens / self.rate)
+        return wait
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.burst and self.blocked_until <= now
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Request middleware pacing everything the bot sends to chats.
+
+    Every chat-addressed request waits for its chat's bucket (private chats
+    ~1 msg/s, groups ~20 msg/min) and then for the global bucket (~30 msg/s),
+    where callback/inline answers go ahead of normal replies and normal
+    replies ahead of `bulk()` sends. A TelegramRetryAfter blocks the
+    affected bucket for retry_after seconds and the request is retried.
+    """
+
+    def __init__(self, global_rate: float = 30, private_rate: float = 1, group_rate: float = 20 / 60,
+                 chat_burst: float = 3, max_retries: int = 3):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._pump: asyncio.Task | None = None
+        self.sent = 0
+        self.flood_waits = 0
+        self._chat_waiting = 0
+
+    # ---------- buckets ----------
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self.private_rate if private else self.group_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire_global(self, priority: int):
+        if not self._heap and self.global_bucket.delay() == 0:
+            self.global_bucket.take()
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), fut))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.create_task(self._run_pump())
+        await fut
+
+    async def _run_pump(self):
+        while self._heap:
+            if self._heap[0][2].done():
+                heapq.heappop(self._heap)
+                continue
+            wait = self.global_bucket.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, fut = heapq.heappop(self._heap)
+            if not fut.done():
+                self.global_bucket.take()
+                fut.set_result(None)
+
+    # ---------- middleware ----------
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod) -> Response:
+        chat_id = getattr(method, "chat_id", None)
+        answer = isinstance(method, _ANSWERS)
+        if chat_id is None and not answer:
+            # getUpdates, getMe, setWebhook, ... are not paced
+            return await make_request(bot, method)
+
+        priority = PRIORITY_ANSWER if answer else _priority.get()
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                bucket = self._chat_bucket(chat_id)
+                wait = bucket.reserve()
+                if wait > 0:
+                    self._chat_waiting += 1
+                    try:
+                        await asyncio.sleep(wait)
+                    finally:
+                        self._chat_waiting -= 1
+            await self._acquire_global(priority)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.flood_waits += 1
+                log.warning("Flood wait %ss on %s (chat %s)", e.retry_after, type(method).__name__, chat_id)
+                if attempt == self.max_retries:
+                    raise
+                target = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                target.block(e.retry_after)
+                continue
+            self.sent += 1
+            return response
+
+    def snapshot(self) -> dict:
+        depth = {PRIORITY_ANSWER: 0, PRIORITY_NORMAL: 0, PRIORITY_BULK: 0}
+        for priority, _, fut in self._heap:
+            if not fut.done():
+                depth[priority] = depth.get(priority, 0) + 1
+        return {
+            "queue_answer": depth[PRIORITY_ANSWER],
+            "queue_normal": depth[PRIORITY_NORMAL],
+            "queue_bulk": depth[PRIORITY_BULK],
+            "waiting_per_chat": self._chat_waiting,
+            "chats_tracked": len(self._chats),
+            "sent": self.sent,
+            "flood_waits": self.flood_waits,
+        }
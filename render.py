@@ -0,0 +1,149 @@
+from aiogram.types import InlineKeyboardMarkup, InlineQueryResultArticle, InputTextMessageContent
+
+import db
+from cache import SingleFlight, TTLCache
+from keyboards import seasons_kb, episodes_kb, ranges_kb, watch_link_kb
+
+PAGE_SIZE = 30
+MAX_RANGES = 48
+LOCKED_TEXT = "🔒 Bu kontent kod bilan yopilgan. 3 xonali kodni yuboring."
+
+# (kind, anime_id, ..., is_admin) -> (db.anime_version at build time, text, markup)
+_rendered = TTLCache(maxsize=8192, ttl=1800)
+# (key, version) -> the build in progress; a burst of taps on one fresh
+# button runs its queries and keyboard building once
+_building = SingleFlight()
+
+
+def anime_card_text(a: dict) -> str:
+    meta = []
+    if a.get("year"):
+        meta.append(f"📅 Yili: {a['year']}")
+    if a.get("country"):
+        meta.append(f"🌍 Davlati: {a['country']}")
+    if a.get("language"):
+        meta.append(f"🗣 Tili: {a['language']}")
+    if a.get("genres"):
+        meta.append(f"🎭 Janri: {a['genres']}")
+    if a.get("description"):
+        meta.append(f"\n📝 {a['description']}")
+
+    lock_line = "🔒 Kod bilan yopilgan" if a.get("is_locked", 0) == 1 else "✅ Ochiq"
+    return (
+        f"🎬 <b>{a['title']}</b>\n"
+        f"🆔 ID: <code>{a['id']}</code>\n"
+        f"{lock_line}\n"
+        + "\n".join(meta)
+    )
+
+
+def anime_article(a: dict, link: str) -> InlineQueryResultArticle:
+    """Inline-mode result: the anime card, posted with a button opening the bot
+    on it. A locked title posts only its name and the lock notice, as the bot
+    itself shows it before the code is sent."""
+    meta = " • ".join(x for x in (a.get("year"), a.get("genres")) if x)
+    if a.get("is_locked", 0) == 1:
+        title = "🔒 " + a["title"]
+        text = f"🎬 <b>{a['title']}</b>\n\n{LOCKED_TEXT}"
+    else:
+        title = a["title"]
+        text = anime_card_text(a)
+    return InlineQueryResultArticle(
+        id=str(a["id"]),
+        title=title,
+        description=meta or None,
+        input_message_content=InputTextMessageContent(message_text=text[:4096]),
+        reply_markup=watch_link_kb(link),
+    )
+
+
+def episode_caption(title: str, season_no: int, episode_no: int) -> str:
+    return f"🎬 {title}\n📺 {season_no}-FASL • {episode_no}-qism"
+
+
+def shared_builds() -> int:
+    """Renders that were served from another caller's build in progress."""
+    return _building.shared
+
+
+def _lookup(key, version: int):
+    hit = _rendered.get(key)
+    if hit is not None and hit[0] == version:
+        return hit[1], hit[2]
+    return None
+
+
+async def anime_card(anime_id: int, is_admin: bool) -> tuple[str, InlineKeyboardMarkup | None] | None:
+    key = ("a", anime_id, is_admin)
+    version = db.anime_version(anime_id)
+    hit = _lookup(key, version)
+    if hit:
+        return hit
+    return await _building.do((key, version), lambda: _build_card(key, version, anime_id, is_admin))
+
+
+async def _build_card(key, version: int, anime_id: int, is_admin: bool):
+    a = await db.get_anime(anime_id)
+    if not a:
+        return None
+    seasons = await db.list_seasons(anime_id)
+    txt = anime_card_text(a)
+    kb = seasons_kb(anime_id, seasons, is_admin=is_admin) if seasons else None
+    _rendered.set(key, (version, txt, kb))
+    return txt, kb
+
+
+async def season_page(anime_id: int, season_no: int, start: int, is_admin: bool) -> tuple[str, InlineKeyboardMarkup]:
+    """The page of episodes numbered from `start`; pages are keyed by episode
+    number rather than page index, so deep pages cost the same as the first."""
+    key = ("p", anime_id, season_no, start, is_admin)
+    version = db.anime_version(anime_id)
+    hit = _lookup(key, version)
+    if hit:
+        return hit
+    return await _building.do((key, version), lambda: _build_page(key, version, anime_id, season_no, start, is_admin))
+
+
+async def _build_page(key, version: int, anime_id: int, season_no: int, start: int, is_admin: bool):
+    page = await db.get_episode_page(anime_id, season_no, start, PAGE_SIZE)
+
+    a = await db.get_anime(anime_id)
+    title = a["title"] if a else "Media"
+    txt = (
+        f"🎬 <b>{title}</b>\n"
+        f"📺 <b>{season_no}-FASL</b>\n"
+        f"Qismlar: {page.total}\n\n"
+        f"Qismni tanlang:"
+    )
+    kb = episodes_kb(anime_id, season_no, page.episodes, page.prev_start, page.next_start, is_admin=is_admin)
+    _rendered.set(key, (version, txt, kb))
+    return txt, kb
+
+
+async def season_ranges(anime_id: int, season_no: int) -> tuple[str, InlineKeyboardMarkup]:
+    """Jump-to-range chooser; ranges widen so there are at most MAX_RANGES buttons."""
+    key = ("j", anime_id, season_no)
+    version = db.anime_version(anime_id)
+    hit = _lookup(key, version)
+    if hit:
+        return hit
+    return await _building.do((key, version), lambda: _build_ranges(key, version, anime_id, season_no))
+
+
+async def _build_ranges(key, version: int, anime_id: int, season_no: int):
+    total = await db.count_episodes(anime_id, season_no)
+    block = PAGE_SIZE * max(1, -(-total // (PAGE_SIZE * MAX_RANGES)))
+    ranges = await db.get_episode_ranges(anime_id, season_no, block)
+    txt = f"📺 <b>{season_no}-FASL</b>\nQismlar: {total}\n\nOraliqni tanlang:"
+    kb = ranges_kb(anime_id, season_no, ranges)
+    _rendered.set(key, (version, txt, kb))
+    return txt, kb
+
+
+async def prerender_season(anime_id: int, season_no: int):
+    """Render every page of a season for users and admin, e.g. right after an upload."""
+    start = 0
+    while start is not None:
+        for is_admin in (False, True):
+            await season_page(anime_id, season_no, start, is_admin)
+        start = (await db.get_episode_page(anime_id, season_no, start, PAGE_SIZE)).next_start
@@ -0,0 +1,42 @@
+import re
+import unicodedata
+
+# Uzbek/Russian Cyrillic -> Uzbek Latin
+_CYR = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo", "ж": "j",
+    "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "x", "ц": "ts",
+    "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya", "ў": "o", "қ": "q", "ғ": "g", "ҳ": "h",
+}
+_TRANSLIT = str.maketrans(_CYR)
+
+# o‘ / o' / oʻ / o` and friends are all spelled differently by users
+_APOSTROPHES = re.compile(r"[‘’ʻʼ`'´]")
+# letters users routinely swap when typing Uzbek by ear
+_FOLD = str.maketrans({"q": "k", "x": "h", "w": "v"})
+# doubled letters only: "100" and "10", "2011" and "201" are different numbers
+_REPEATS = re.compile(r"([^\W\d_])\1+")
+_WORD = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """Spelling-insensitive form used both for indexing and for queries."""
+    if not text:
+        return ""
+    s = text.lower().translate(_TRANSLIT)
+    s = _APOSTROPHES.sub("", s)
+    s = unicodedata.normalize("NFKD", s)
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    s = s.translate(_FOLD)
+    return _REPEATS.sub(r"\1", s)
+
+
+def facet_key(text: str) -> str:
+    """Case- and spacing-insensitive key for browse values. Unlike fold() it
+    keeps spelling as typed: no transliteration or letter folding."""
+    return " ".join(text.casefold().split())
+
+
+def tokens(text: str) -> list[str]:
+    return _WORD.findall(fold(text))
@@ -0,0 +1,113 @@
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+
+class SlidingWindowLimiter:
+    """Per-key attempt limits over sliding windows, e.g. ((5, 60), (20, 3600))
+    = at most 5 attempts a minute and 20 an hour.
+
+    State lives in this process only. The polling supervisor routes a chat to
+    one worker, but behind a load balancer each webhook instance counts on its
+    own, so give each instance its share of the limits (see split_limits).
+    """
+
+    def __init__(self, limits: tuple[tuple[int, float], ...], sweep_every: int = 1000):
+        self.limits = tuple(sorted(limits, key=lambda l: l[1]))
+        self.span = self.limits[-1][1]
+        self.sweep_every = sweep_every
+        self._hits: dict[int, deque] = {}
+        self._calls = 0
+
+    def _trim(self, hits: deque, now: float):
+        while hits and hits[0] <= now - self.span:
+            hits.popleft()
+
+    def retry_after(self, key: int, now: float | None = None) -> float:
+        """Seconds until `key` may try again (0 if it may try now)."""
+        now = time.monotonic() if now is None else now
+        hits = self._hits.get(key)
+        if not hits:
+            return 0.0
+        self._trim(hits, now)
+        wait = 0.0
+        for count, window in self.limits:
+            if len(hits) >= count:
+                # the attempt that has to age out before another is allowed
+                wait = max(wait, hits[-count] + window - now)
+        return max(0.0, wait)
+
+    def hit(self, key: int) -> float:
+        """Record an attempt unless over the limit; returns retry_after()
+        (0 means the attempt was allowed and counted)."""
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % self.sweep_every == 0:
+            self.sweep(now)
+        wait = self.retry_after(key, now)
+        if wait:
+            return wait
+        self._hits.setdefault(key, deque()).append(now)
+        return 0.0
+
+    def reset(self, key: int):
+        self._hits.pop(key, None)
+
+    def sweep(self, now: float | None = None):
+        """Forget keys with no attempt inside the longest window."""
+        now = time.monotonic() if now is None else now
+        for key in [k for k, hits in self._hits.items() if not hits or hits[-1] <= now - self.span]:
+            del self._hits[key]
+
+
+def split_limits(limits: tuple[tuple[int, float], ...], processes: int) -> tuple[tuple[int, float], ...]:
+    """`limits` shared between `processes` independent limiters, at least one
+    attempt per window each."""
+    n = max(processes, 1)
+    return tuple((max(1, count // n), window) for count, window in limits)
+
+
+class DoubleTapGuard(BaseMiddleware):
+    """Outer callback_query middleware: a second tap on the same button by the
+    same user, while the first is still being handled or less than `window`
+    seconds after it, is answered at once and dropped, so impatient taps do
+    not re-send a video or re-render a page.
+
+    State is per process. The polling supervisor routes a chat to one
+    worker, but behind a load balancer a second tap may reach another
+    webhook instance; that tap is then handled normally, which costs a
+    duplicate reply and nothing more.
+    """
+
+    def __init__(self, window: float = 1.5, sweep_every: int = 1000):
+        self.window = window
+        self.sweep_every = sweep_every
+        # (user_id, callback data) -> [accepted at, still being handled]
+        self._taps: dict[tuple[int, str], list] = {}
+        self._calls = 0
+        self.dropped = 0
+
+    async def __call__(self, handler: Callable[[CallbackQuery, dict[str, Any]], Awaitable[Any]],
+                       event: CallbackQuery, data: dict[str, Any]) -> Any:
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % self.sweep_every == 0:
+            self.sweep(now)
+        key = (event.from_user.id, event.data or "")
+        tap = self._taps.get(key)
+        if tap is not None and (tap[1] or now - tap[0] < self.window):
+            self.dropped += 1
+            return event.answer()
+        tap = self._taps[key] = [now, True]
+        try:
+            return await handler(event, data)
+        finally:
+            tap[1] = False
+
+    def sweep(self, now: float | None = None):
+        now = time.monotonic() if now is None else now
+        for key in [k for k, (at, running) in self._taps.items() if not running and now - at >= self.window]:
+            del self._taps[key]
@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+log = logging.getLogger(__name__)
+
+
+def build_app(dp: Dispatcher, bot: Bot, path: str = "/webhook", secret: str = "",
+              reply_in_response: bool = False) -> web.Application:
+    """aiohttp app serving Telegram updates on `path`.
+
+    With `reply_in_response` the update is handled before the HTTP reply, so a
+    TelegramMethod returned by a handler (e.g. `return call.answer()`) is sent
+    back as the webhook response instead of a separate API request.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret or None,
+        handle_in_background=not reply_in_response,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str = "0.0.0.0", port: int = 8080,
+                      path: str = "/webhook", secret: str = "", url: str = "",
+                      reply_in_response: bool = False):
+    if url and not secret:
+        # a public webhook without the secret header check accepts forged
+        # updates from anyone, including ones "from" the admin
+        raise RuntimeError("WEBHOOK_URL berilgan bo‘lsa, WEBHOOK_SECRET ham kerak.")
+    app = build_app(dp, bot, path=path, secret=secret, reply_in_response=reply_in_response)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    log.info("Webhook server: http://%s:%s%s", host, port, path)
+
+    # without a public URL the server only takes locally POSTed updates
+    if url:
+        await bot.set_webhook(
+            url.rstrip("/") + path,
+            secret_token=secret or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    try:
+        await stop.wait()
+    finally:
+        # stops accepting, lets in-flight updates finish, then runs dp shutdown
+        # and closes the bot session
+        await runner.cleanup()
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import multiprocessing as mp
+import signal
+import sys
+
+from aiogram import Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+import db
+
+log = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+CACHE_SYNC_INTERVAL = 2.0
+CHANGES_PRUNE_EVERY = 300
+
+
+def chat_key(update: Update) -> int:
+    ctx = UserContextMiddleware.resolve_event_context(update)
+    if ctx.chat:
+        return ctx.chat.id
+    return ctx.user.id if ctx.user else 0
+
+
+def shard_of(key: int, shards: int) -> int:
+    return key % shards
+
+
+async def cache_sync_loop(prune: bool = False):
+    """Follow catalogue writes made by other processes sharing the database
+    (workers, webhook instances, importer.py); `prune` trims catalog_changes."""
+    ticks = 0
+    while True:
+        await asyncio.sleep(CACHE_SYNC_INTERVAL)
+        try:
+            await db.sync_changes()
+            ticks += 1
+            if prune and ticks * CACHE_SYNC_INTERVAL >= CHANGES_PRUNE_EVERY:
+                ticks = 0
+                await db.prune_changes()
+        except Exception:
+            log.exception("cache sync failed")
+
+
+# ---------- SUPERVISOR ----------
+class _Worker:
+    def __init__(self, index: int, ctx):
+        self.index = index
+        self.ctx = ctx
+        self.queue = ctx.Queue(maxsize=QUEUE_SIZE)
+        self.proc = None
+
+    def start(self):
+        self.proc = self.ctx.Process(target=_worker_entry, args=(self.index, self.queue), name=f"worker-{self.index}")
+        self.proc.start()
+
+
+async def run_supervisor(bot: Bot, dp: Dispatcher, workers: int, polling_timeout: int = 30):
+    """Poll Telegram in this process and hand every update to worker
+    `chat_id % workers`, so one chat is always served by the same process in
+    arrival order."""
+    ctx = mp.get_context("spawn")
+    pool = [_Worker(i, ctx) for i in range(workers)]
+    for w in pool:
+        w.start()
+    log.info("Started %s workers", workers)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    allowed = dp.resolve_used_update_types()
+    offset = None
+    try:
+        while not stop.is_set():
+            for w in pool:
+                if not w.proc.is_alive():
+                    log.warning("worker-%s exited with %s, restarting", w.index, w.proc.exitcode)
+                    w.start()
+
+            poll = asyncio.create_task(bot.get_updates(offset=offset, timeout=polling_timeout, allowed_updates=allowed))
+            stopped = asyncio.create_task(stop.wait())
+            done, _ = await asyncio.wait({poll, stopped}, return_when=asyncio.FIRST_COMPLETED)
+            if poll not in done:
+                poll.cancel()
+                break
+            stopped.cancel()
+
+            try:
+                updates = poll.result()
+            except Exception:
+                log.exception("getUpdates failed")
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                key = chat_key(update)
+                payload = (key, update.model_dump_json(exclude_unset=True))
+                await loop.run_in_executor(None, pool[shard_of(key, workers)].queue.put, payload)
+                offset = update.update_id + 1
+    finally:
+        for w in pool:
+            w.queue.put(None)
+        for w in pool:
+            await loop.run_in_executor(None, w.proc.join, 30)
+        await bot.session.close()
+
+
+# ---------- WORKER ----------
+def _app_module():
+    """main.py as already loaded in this process. Under spawn the parent's
+    script is re-run as __mp_main__; importing `main` on top of that would
+    build a second bot and dispatcher and register every handler twice."""
+    mp_main = sys.modules.get("__mp_main__")
+    if mp_main is not None and hasattr(mp_main, "startup"):
+        return mp_main
+    import main
+    return main
+
+
+def _worker_entry(index: int, queue):
+    main = _app_module()  # this process's own bot, dispatcher and FSM storage
+
+    logging.basicConfig(level=logging.INFO, format=f"[w{index}] %(levelname)s:%(name)s:%(message)s")
+    # the supervisor decides when to stop and sends a sentinel
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_worker_loop(main, index, queue))
+
+
+async def _worker_loop(main, index: int, queue):
+    bot, dp = main.bot, main.dp
+    loop = asyncio.get_running_loop()
+    # chat_id -> [lock, pending]; keeps one chat's updates strictly ordered
+    # while different chats run concurrently
+    chats: dict[int, list] = {}
+    tasks: set[asyncio.Task] = set()
+
+    async def handle(key: int, raw: str):
+        slot = chats.setdefault(key, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                response = await dp.feed_raw_update(bot, json.loads(raw))
+                if isinstance(response, TelegramMethod):
+                    await dp.silent_call_request(bot, response)
+        except Exception:
+            log.exception("update failed")
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                chats.pop(key, None)
+
+    try:
+        # a startup failure must still reach shutdown(): open db threads would
+        # keep the process alive and the supervisor would never restart it
+        await main.startup(primary=main.PRIMARY and index == 0, index=index)
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            task = asyncio.create_task(handle(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+    finally:
+        await main.shutdown()
+        await bot.session.close()